@@ -0,0 +1,641 @@
+""" arrayengine.py
+An alternate engine for World.step that keeps foragers and households in NumPy
+arrays instead of Forager and HHAgent objects.  Select it with
+W.setEngine('array') or World(engine='array').
+
+A step runs HHAgent.step for each household in activation order, in the same
+order of phases as the object engine: eating, moving, foraging, eating again,
+asking neighbors for help, deaths, sharing excess food, births, and aging,
+coming of age and mating of the members.  Where a household moves and how much
+it gathers depends on what the households before it have already taken from the
+landscape, and help, sharing and mating depend on debts and marriages that
+change as each household acts, so running a phase for everyone before the next
+one starts biases the results (sharing before neighbors have aged and married,
+for one, changes how much help reaches a starving household).  The step runs on
+plain lists copied out of the arrays, and only the activation order and the
+step's statistics are vectorized, so it runs about twice as fast as the object
+engine, not more; a larger gain needs that loop compiled.
+
+The engine reproduces the model's statistics, not the object engine's exact
+trajectories; benchmark.engineEquivalence compares the two on the
+forage_experiment output metrics.
+"""
+
+import math
+import numpy as NP
+import forager as F
+import hhagent as HH
+import metrics as M
+import utility as U
+
+NO_ONE = -1
+
+# per-forager arrays, by forager ID, and their initial values
+FORAGER_FIELDS = [('f_alive', bool, False),     # a member of a household in the world
+                  ('f_age', int, 0),
+                  ('f_need', float, 0.0),
+                  ('f_fed', float, 0.0),
+                  ('f_expertise', float, 0.0),  # innate foraging expertise
+                  ('f_span', float, 0.0),       # kinship span
+                  ('f_lineage', int, NO_ONE),
+                  ('f_hh', int, NO_ONE),
+                  ('f_mate', int, NO_ONE),
+                  ('f_is_parent', bool, False),
+                  ('f_dead', bool, False)]      # died while stepping; leaves at its household's next check
+
+# per-household arrays, by household ID
+HOUSEHOLD_FIELDS = [('h_alive', bool, False),
+                    ('h_storage', float, 0.0),
+                    ('h_age', int, 0),
+                    ('h_lineage', int, NO_ONE),
+                    ('h_baby', int, NO_ONE)]    # forager ID of the baby joining next step
+
+OFFSETS = [(a, b) for a in range(-1, 2) for b in range(-1, 2)]
+DISC = [(dx, dy) for dx in range(-1, 2) for dy in range(-1, 2) if dx**2 + dy**2 <= 1]
+
+# forager.baseFoodNeed and forager.foragingExpertiseAt, over arrays of foragers
+baseFoodNeed = NP.vectorize(F.baseFoodNeed, otypes=[float])
+foragingExpertise = NP.vectorize(F.foragingExpertiseAt, otypes=[float])
+
+class ArrayEngine(object):
+
+    def __init__(self, world, numagents, kinship_spans):
+        self.world = world
+        self.config = world.config
+        self.width = world.config.width
+        self.f_count = 0
+        self.h_count = 0
+        self.allocate(FORAGER_FIELDS, max(16, 4*numagents))
+        self.allocate(HOUSEHOLD_FIELDS, max(16, 2*numagents))
+        self.h_parents = []   # forager IDs of each household's parents, by household ID
+        self.h_children = []  # forager IDs of each household's children, in order of arrival
+        self.h_cell = []      # cell of each household, by household ID
+        self.cells = {}       # cell -> IDs of the households there, in order of arrival
+        for x in range(self.width):
+            for y in range(self.width):
+                self.cells[x,y] = []
+        self.around = {}      # cell -> the residents lists of the cells within radius 1 of it
+        for x, y in self.cells:
+            self.around[x,y] = [self.cells[(x+dx)%self.width, (y+dy)%self.width] for dx, dy in DISC]
+        # x*width + y -> the same for the cells at OFFSETS from (x, y), as indices into the flattened landscape
+        self.offset_cells = [[((x+a)%self.width)*self.width + (y+b)%self.width for a, b in OFFSETS]
+                             for x in range(self.width) for y in range(self.width)]
+        self.kin_sets = {}    # household ID -> kin set, valid until membership changes
+        self.members = {}     # household ID -> membersOf, valid until membership changes
+        self.activation = world.streams.activation
+        self.demography = world.streams.demography
+        self.movement = world.streams.movement
+
+        for span in kinship_spans:
+            h = self.newHousehold((self.movement.randrange(self.width), self.movement.randrange(self.width)))
+            founder = self.newForagers(1, age=NP.array([self.demography.randrange(F.AGE_OF_ADULT, F.AGE_OF_SENIOR)]), span=span)[0]
+            spouse = self.newForagers(1, age=self.f_age[[founder]], span=span)[0]
+            self.join(founder, h, parent=True)
+            self.join(spouse, h, parent=True)
+            self.f_mate[founder] = spouse
+            self.f_mate[spouse] = founder
+
+    """
+    storage
+    """
+    def allocate(self, fields, capacity):
+        for name, dtype, initial in fields:
+            setattr(self, name, NP.full(capacity, initial, dtype=dtype))
+
+    def grow(self, fields, count, needed):
+        capacity = len(getattr(self, fields[0][0]))
+        if needed > capacity:
+            capacity = max(needed, 2*capacity)
+            for name, dtype, initial in fields:
+                array = NP.full(capacity, initial, dtype=dtype)
+                array[:count] = getattr(self, name)[:count]
+                setattr(self, name, array)
+
+    def newForagers(self, n, age, span):
+        # founders; babies are born one at a time by newBaby
+        self.grow(FORAGER_FIELDS, self.f_count, self.f_count + n)
+        ids = NP.arange(self.f_count, self.f_count + n)
+        self.f_count += n
+        self.f_age[ids] = age
+        self.f_need[ids] = baseFoodNeed(self.f_age[ids])
+        self.f_fed[ids] = self.f_need[ids]
+        self.f_span[ids] = span
+        self.f_expertise[ids] = self.founderExpertise(n)
+        for ID in ids:
+            self.world.pedigree.add(int(ID), [])
+        return ids
+
+    def founderExpertise(self, n):
+        # Forager.setExpertise for n foragers without parents at once
+        avg = self.config.avg_foraging_expertise
+        stddev = self.config.stddev_foraging_expertise
+        if stddev==0:
+            return NP.full(n, avg)
+        birth_factor = 1 + self.demography.normals.take(0, stddev, -6*stddev, 6*stddev, n)
+        return NP.clip(avg*birth_factor, 0, 2*avg)
+
+    def newHousehold(self, cell, lineage=NO_ONE):
+        self.grow(HOUSEHOLD_FIELDS, self.h_count, self.h_count + 1)
+        h = self.h_count
+        self.h_count += 1
+        self.h_alive[h] = True
+        self.h_lineage[h] = h if lineage == NO_ONE else lineage
+        self.h_cell.append(cell)
+        self.h_parents.append([])
+        self.h_children.append([])
+        self.cells[cell].append(h)
+        return h
+
+    def join(self, f, h, parent=False):
+        old = self.f_hh[f]
+        if old != NO_ONE:
+            self.leave(f)
+        if parent:
+            self.h_parents[h].append(f)
+        else:
+            self.h_children[h].append(f)
+        self.f_hh[f] = h
+        self.f_is_parent[f] = parent
+        self.f_alive[f] = True
+        self.kin_sets.pop(h, None)
+        self.members.pop(h, None)
+
+    def leave(self, f):
+        h = self.f_hh[f]
+        if self.f_is_parent[f]:
+            self.h_parents[h].remove(f)
+        else:
+            self.h_children[h].remove(f)
+        self.f_hh[f] = NO_ONE
+        self.f_alive[f] = False
+        self.kin_sets.pop(h, None)
+        self.members.pop(h, None)
+
+    def removeHousehold(self, h):
+        self.h_alive[h] = False
+        self.cells[self.h_cell[h]].remove(h)
+        self.world.ledger.remove(h)
+        self.kin_sets.pop(h, None)
+
+    def membersOf(self, h):
+        # a new list whenever membership changes, so it can be iterated while members join or leave
+        members = self.members.get(h)
+        if members is None:
+            members = self.members[h] = self.h_parents[h] + self.h_children[h]
+        return members
+
+    def size(self, h):
+        return len(self.h_parents[h]) + len(self.h_children[h])
+
+    def householdCount(self):
+        return int(self.h_alive[:self.h_count].sum())
+
+    def livingForagers(self, houses=None):
+        foragers = NP.nonzero(self.f_alive[:self.f_count])[0]
+        if houses is not None:
+            selected = NP.zeros(self.h_count, dtype=bool)
+            selected[houses] = True
+            foragers = foragers[selected[self.f_hh[foragers]]]
+        return foragers
+
+    def localHooverIndices(self, radius=1):
+        """
+        World.localHooverIndices, computed for every cell at once: each household's storage is
+        counted at every cell within radius of it, and the indices are U.groupedHoover over those
+        (cell, storage) pairs.  Equal to the object engine's indices up to float rounding.
+        """
+        width = self.width
+        houses = NP.nonzero(self.h_alive[:self.h_count])[0]
+        if len(houses) == 0:
+            return {}
+        x, y = NP.array([self.h_cell[h] for h in houses]).T
+        offsets = self.world.spatial.discOffsets(radius)
+        cells = NP.concatenate([((x + dx)%width)*width + (y + dy)%width for dx, dy in offsets])
+        values = NP.tile(self.h_storage[houses], len(offsets))
+        labels, hoovers = U.groupedHoover(values, cells)
+        counts = NP.bincount(cells)[labels]
+        shared = counts >= 2
+        return dict(zip([divmod(cell, width) for cell in labels[shared].tolist()], hoovers[shared].tolist()))
+
+    """
+    kinship
+    """
+    def kinSet(self, h):
+        kin_set = self.kin_sets.get(h)
+        if kin_set is None:
+            kin_set = set()
+            for f in self.membersOf(h):
+                kin_set |= self.world.pedigree.ancestors(int(f), self.ancestryDepth(f))
+            self.kin_sets[h] = kin_set
+        return kin_set
+
+    def ancestryDepth(self, f):
+        depth = max(0, math.ceil(self.f_span[f]))
+        if not self.config.full_ancestry:
+            depth = min(depth, 1)
+        return depth
+
+    def areKin(self, h, g):
+        return not self.kinSet(h).isdisjoint(self.kinSet(g))
+
+    def foragersAreKin(self, f, g):
+        return self.world.pedigree.areKin(int(f), self.ancestryDepth(f), int(g), self.ancestryDepth(g))
+
+    """
+    step
+    """
+    def step(self, collect=M.COLLECTIONS):
+        # World.stepHouseholds records each household as soon as it has stepped, before
+        # households later in the order share with it, repay it or marry into it
+        world = self.world
+        world.population = 0
+        world.kinship_spans = []
+        world.pop_expertise = []
+        world.hh_prestige = []
+        world.hh_food_stored = []
+        self.collect = collect
+        self.empty = []
+        houses = self.activationOrder()
+        self.unpack()
+        while len(houses):
+            # households founded during a pass step after it, as the ones World.step appends do
+            self.spawned = []
+            self.stepHouseholds(houses)
+            houses = NP.array(self.spawned, dtype=int)
+        self.pack()
+
+        # World.step: households left without members are gone
+        for h in self.empty:
+            self.removeHousehold(h)
+
+    def stepHouseholds(self, houses):
+        world = self.world
+        self.h_age[houses] += 1  # those combined into others before their turn are gone anyway
+        for h in houses.tolist():
+            if not self.h_alive[h]:  # combined into a household that stepped before it
+                continue
+            self.stepHousehold(h)
+            if self.hasDied(h):
+                world.tot_hh_age += int(self.h_age[h])
+                world.dead_houses += 1
+                self.empty.append(h)
+            else:
+                self.record(h)
+
+    def record(self, h):
+        world = self.world
+        members = self.membersOf(h)
+        world.population += len(members)
+        if M.MEMBERS in self.collect:
+            for f in members:
+                world.kinship_spans.append(self.spans[f])
+                world.pop_expertise.append(self.expertise[f])
+        if M.PRESTIGE in self.collect:
+            world.hh_prestige.append(world.ledger.prestigeOf(h))
+        if M.STORAGE in self.collect:
+            world.hh_food_stored.append(self.storage[h])
+
+    def activationOrder(self):
+        houses = NP.nonzero(self.h_alive[:self.h_count])[0]
+        if self.config.homogeneous():
+            return self.activation.np.permutation(houses)
+        foragers = self.livingForagers()
+        ability = NP.bincount(self.f_hh[foragers], minlength=self.h_count,
+                              weights=foragingExpertise(self.f_expertise[foragers], self.f_age[foragers]))
+        noise = self.activation.normals.take(1, 0.2, 0.5, 1.5, len(houses))
+        return houses[NP.argsort(ability[houses]*noise, kind='stable')]
+
+    """
+    the household step; it works on plain lists copied out of the arrays
+    """
+    def unpack(self):
+        self.res = self.world.foraging_resources.ravel().tolist()
+        self.storage = self.h_storage[:self.h_count].tolist()
+        self.need = self.f_need[:self.f_count].tolist()
+        self.fed = self.f_fed[:self.f_count].tolist()
+        self.ages = self.f_age[:self.f_count].tolist()
+        self.expertise = self.f_expertise[:self.f_count].tolist()
+        self.spans = self.f_span[:self.f_count].tolist()
+        self.dying = set(NP.nonzero(self.f_dead[:self.f_count])[0].tolist())
+
+    def pack(self):
+        resources = self.world.foraging_resources
+        resources[:] = NP.array(self.res).reshape(resources.shape)
+        self.h_storage[:self.h_count] = self.storage
+        self.f_need[:self.f_count] = self.need
+        self.f_fed[:self.f_count] = self.fed
+        self.f_age[:self.f_count] = self.ages
+        self.f_expertise[:self.f_count] = self.expertise
+        self.f_dead[:self.f_count] = False
+        self.f_dead[list(self.dying)] = True
+
+    def stepHousehold(self, h):
+        # HHAgent.step
+        width = self.width
+        res = self.res
+        self.eatOne(h)  # may have received food shared by others
+        x, y = self.h_cell[h]
+        bx, by = divmod(self.bestCellAround(x, y), width)
+        new_x, new_y = x, y
+        if (bx, by) != (x, y):
+            # HHAgent.evaluateLocationAgainst
+            size = self.size(h)
+            cost_to_relocate = HH.moveCost(self.config, size, self.world.spatial.distanceBetween((x, y), (bx, by)))
+            cost_to_stay = HH.moveCost(self.config, size, 0)
+            here = res[x*width + y]
+            there = res[bx*width + by]
+            if self.config.grn_help:
+                here += self.kinStorageAround(h, (x, y))
+                there += self.kinStorageAround(h, (bx, by)) - self.storage[h]
+            if (there - cost_to_relocate) - (here - cost_to_stay) > 0:
+                new_x, new_y = bx, by
+        self.moveTo(h, new_x, new_y)
+        if self.hungry(h):
+            self.forage(h)
+            self.eatOne(h)
+        if self.hungry(h):
+            self.askNeighborsForHelp(h)
+        if not self.hasDied(h):
+            if self.config.brn_help or self.config.grn_help or self.config.communal_sharing:
+                self.disposeOf(h)
+            self.makeABaby(h)
+            self.stepMembers(h)
+        if self.storage[h] < 0:  # floating point residue, as HHAgent.step clears it
+            self.storage[h] = 0
+
+    def bestCellAround(self, x, y):
+        # World.bestLocationAt: the richest of the cells around (x, y), as an index into the flattened
+        # landscape; a tie is broken by scanning in the order World.scanLocationsAt does
+        res = self.res
+        best = 0
+        best_cell = 0
+        tied = False
+        for cell in self.offset_cells[x*self.width + y]:
+            if best < res[cell]:
+                best = res[cell]
+                best_cell = cell
+                tied = False
+            elif best == res[cell] and best > 0:
+                tied = True
+        if tied:
+            best = 0
+            best_cell = 0
+            for a, b in self.world.scanOffsets():
+                cell = ((x+a)%self.width)*self.width + (y+b)%self.width
+                if best < res[cell]:
+                    best = res[cell]
+                    best_cell = cell
+        return best_cell
+
+    def hasDied(self, h):
+        # HHAgent.hasDied
+        for f in self.membersOf(h):
+            if self.ages[f] == F.OLDEST or self.fed[f]/self.need[f] < 0 or f in self.dying:
+                self.bury(f)
+        return self.size(h) == 0
+
+    def bury(self, f):
+        self.world.reportADeathAt(self.ages[f])
+        mate = self.f_mate[f]
+        if mate != NO_ONE:
+            self.f_mate[mate] = NO_ONE
+        self.leave(f)
+        self.dying.discard(f)
+        self.world.pedigree.forget(int(f))
+
+    def makeABaby(self, h):
+        # HHAgent.makeABaby
+        baby = self.h_baby[h]
+        if baby != NO_ONE:
+            self.join(baby, h)
+            self.h_baby[h] = NO_ONE
+        parents = self.h_parents[h]
+        if (len(parents) == 2 and self.ages[parents[0]] <= F.AGE_OF_SENIOR and self.ages[parents[1]] <= F.AGE_OF_SENIOR
+                and self.demography.random() < self.config.birth_rate):
+            self.h_baby[h] = self.newBaby(h, parents[0], parents[1])
+
+    def newBaby(self, h, p0, p1):
+        # World.newForager(age=0, parents=[p0, p1])
+        f = self.f_count
+        self.grow(FORAGER_FIELDS, self.f_count, f + 1)
+        self.f_count += 1
+        need = 1/F.AGE_OF_ADULT
+        self.ages.append(0)
+        self.need.append(need)
+        self.fed.append(need)
+        self.expertise.append(self.babyExpertise(p0, p1))
+        self.f_span[f] = self.spans[p1]
+        self.spans.append(self.spans[p1])
+        self.f_lineage[f] = self.h_lineage[h]
+        self.world.pedigree.add(f, [int(p0), int(p1)])
+        return f
+
+    def babyExpertise(self, p0, p1):
+        # Forager.setExpertise
+        avg = self.config.avg_foraging_expertise
+        stddev = self.config.stddev_foraging_expertise
+        if stddev==0:
+            return avg
+        birth_factor = 1 + self.demography.normals.draw(0, stddev, -6*stddev, 6*stddev)
+        w1 = self.demography.random()*0.5 + 0.25
+        expertise = (w1*self.expertiseOf(p0) + (1 - w1)*self.expertiseOf(p1))*birth_factor
+        return min(max(expertise, 0), 2*avg)
+
+    def stepMembers(self, h):
+        # Forager.step for each member; a member that dies leaves at its household's next hasDied
+        for f in self.membersOf(h):
+            self.ages[f] += 1
+            age = self.ages[f]
+            if age == F.OLDEST or self.fed[f]/self.need[f] < 0:
+                self.dying.add(f)
+            else:
+                if age == F.AGE_OF_ADULT:
+                    self.spawnHouseholdFrom(f)
+                if age >= F.AGE_OF_ADULT and self.f_mate[f] == NO_ONE:
+                    self.findAMate(f)
+            self.need[f] = F.baseFoodNeed(age) + (self.need[f] - self.fed[f])
+            self.fed[f] = 0
+
+    def spawnHouseholdFrom(self, f):
+        # World.spawnHouseholdFrom
+        h = self.newHousehold(self.h_cell[self.f_hh[f]], self.f_lineage[f])
+        self.storage.append(0.0)
+        self.join(f, h, parent=True)
+        self.spawned.append(h)
+
+    def findAMate(self, f):
+        h = self.f_hh[f]
+        bachelors = []
+        for neighbor in self.neighborsOf(h):
+            for member in self.membersOf(neighbor):
+                if self.ages[member] >= F.AGE_OF_ADULT and self.f_mate[member] == NO_ONE:
+                    bachelors.append(member)
+        self.demography.shuffle(bachelors)
+        for bachelor in bachelors:
+            if not self.foragersAreKin(f, bachelor):
+                self.marry(f, bachelor)
+                break
+
+    def marry(self, f, mate):
+        h = self.f_hh[f]
+        if self.f_is_parent[mate]:
+            # HHAgent.combineWith
+            other = self.f_hh[mate]
+            for child in list(self.h_children[other]):
+                self.join(child, h)
+            self.storage[h] += self.storage[other]
+            self.removeHousehold(other)
+        self.f_mate[f] = mate
+        self.f_mate[mate] = f
+        self.join(mate, h, parent=True)
+
+    def neighborsOf(self, h):
+        neighbors = self.residentsAround(self.h_cell[h])
+        neighbors.remove(h)
+        self.movement.shuffle(neighbors)
+        return neighbors
+
+    def residentsAround(self, cell):
+        residents = []
+        for around in self.around[cell]:
+            residents.extend(around)
+        return residents
+
+    def moveTo(self, h, x, y):
+        old = self.h_cell[h]
+        cost = HH.moveCost(self.config, 1, self.world.spatial.distanceBetween(old, (x, y)))  # per member
+        if old != (x, y):
+            self.cells[old].remove(h)
+            self.cells[x,y].append(h)
+            self.h_cell[h] = (x, y)
+            if self.config.brn_help or self.config.grn_help or self.config.communal_sharing:
+                self.disposeOf(h)
+            self.storage[h] = 0
+        for f in self.membersOf(h):
+            self.fed[f] -= cost
+
+    def hungry(self, h):
+        for f in self.membersOf(h):
+            if self.fed[f]/self.need[f] < 1.0:
+                return True
+        return False
+
+    def foodNeeds(self, h):
+        return sum([self.need[f] - self.fed[f] for f in self.membersOf(h)])
+
+    def forage(self, h):
+        x, y = self.h_cell[h]
+        cell = x*self.width + y
+        ability = 0
+        for f in self.membersOf(h):
+            ability += self.expertiseOf(f)
+        available = self.res[cell]
+        gathered = 0 if available <= 0 else min(ability, available)
+        self.res[cell] -= gathered
+        self.storage[h] += gathered
+
+    def expertiseOf(self, f):
+        # Forager.foragingExpertise
+        return F.foragingExpertiseAt(self.expertise[f], self.ages[f])
+
+    def eatOne(self, h):
+        members = self.membersOf(h)
+        needs = sum([self.need[f] - self.fed[f] for f in members])
+        if needs > 0:
+            fraction = min(self.storage[h]/needs, 1)
+            for f in members:
+                amount = fraction*(self.need[f] - self.fed[f])
+                self.fed[f] += amount
+                self.storage[h] -= amount
+            if self.storage[h] < 0:  # rounding residue, as HHAgent.eat clears it
+                self.storage[h] = 0
+
+    def isStarving(self, h):
+        # HHAgent.isStarving: the cost of a diagonal move
+        cost_to_forage = self.config.subsistence_threshold*HH.moveCost(self.config, self.size(h),
+                                                                         self.world.spatial.distanceBetween((0, 0), (1, 1)))
+        x, y = self.h_cell[h]
+        food_amount = self.storage[h] + self.res[x*self.width + y]
+        return self.hungry(h) and food_amount < self.foodNeeds(h) + cost_to_forage
+
+    def kinStorageAround(self, h, cell):
+        return sum([self.storage[g] for g in self.residentsAround(cell) if self.areKin(h, g)])
+
+    def giveFood(self, giver, receiver, amount):
+        # HHAgent.giveFoodTo followed by the receiver's increaseCommitments
+        world = self.world
+        amount = min(amount, self.storage[giver])
+        self.storage[receiver] += amount
+        self.storage[giver] -= amount
+        if receiver != giver:
+            if self.config.grn_help and self.areKin(receiver, giver):
+                world.reportGRNSharing(amount)
+            elif self.config.brn_help:
+                world.ledger.record(receiver, giver, amount)
+                world.reportBRNSharing(amount)
+            elif self.config.communal_sharing:
+                world.reportCOMSharing(amount)
+            world.reportFoodSharing(amount)
+        return amount
+
+    def askNeighborsForHelp(self, h):
+        neighbors = self.neighborsOf(h)
+        if not neighbors:
+            self.moveTo(h, self.movement.randrange(self.width), self.movement.randrange(self.width))
+            self.forage(h)
+            self.eatOne(h)
+        elif self.config.grn_help or self.config.brn_help:
+            kin = [g for g in neighbors if self.areKin(h, g)]
+            if self.config.grn_help:
+                total_kin_storage = sum([self.storage[g] for g in kin])
+                food_deficit = self.foodNeeds(h) - self.storage[h]
+                if total_kin_storage > 0 and food_deficit > 0:
+                    for g in kin:
+                        self.giveFood(g, h, food_deficit*self.storage[g]/total_kin_storage)
+                        self.eatOne(h)
+            if self.config.brn_help and self.isStarving(h):
+                ledger = self.world.ledger
+                nonkin = [g for g in neighbors if g not in kin]
+                nonkin = sorted(nonkin, key=lambda g: ledger.debt(g, h))
+                for g in nonkin:
+                    food_deficit = self.foodNeeds(h) - self.storage[h]
+                    if food_deficit > 0:
+                        self.giveFood(g, h, food_deficit)
+                        self.eatOne(h)
+                    else:
+                        break
+
+    def disposeOf(self, h):
+        # HHAgent.dispositionExcess
+        ledger = self.world.ledger
+        if not (self.config.communal_sharing or self.config.grn_help):
+            # with BRN alone, only a household in debt has anything to do
+            debts = ledger.owed.get(h)
+            if not debts or max(debts.values()) <= 0:
+                return
+        neighbors = self.neighborsOf(h)
+        credits = ledger.owed.get(h, {})
+        set_aside = 0
+        for g in neighbors:
+            if g in credits:
+                set_aside -= credits[g]
+        food_shared = self.storage[h] - min(set_aside, self.storage[h])
+        if neighbors:
+            neighbors = sorted(neighbors, key=lambda g: ledger.debt(g, h))
+            if self.config.brn_help:
+                for g in [g for g in neighbors if ledger.debt(h, g) > 0]:
+                    if food_shared <= 0:
+                        break
+                    food_shared -= self.giveFood(h, g, ledger.debt(h, g))
+            if self.config.communal_sharing:
+                sharers = [g for g in neighbors if ledger.debt(g, h) >= 0]
+            elif self.config.grn_help:
+                sharers = [g for g in neighbors if self.areKin(h, g)]
+            else:
+                return
+            sharers.append(h)
+            count = sum([self.size(g) for g in sharers])
+            if food_shared > 0 and count:
+                portion = food_shared/count
+                for g in sharers:
+                    self.giveFood(h, g, portion*self.size(g))
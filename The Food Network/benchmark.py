@@ -0,0 +1,761 @@
+""" benchmark.py
+Performance checks for the foraging ABM.  Run this module directly; each check
+prints its measurements and the script exits with a non-zero status if any
+check fails its budget.
+"""
+
+import subprocess
+import sys
+import os
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+"""
+import-time check
+"""
+# modules a headless batch worker imports; none of them may load a plotting stack
+HEADLESS_MODULES = ['landscape', 'world', 'hhagent', 'forager', 'experiment', 'forage_experiment']
+PLOTTING_MODULES = ['matplotlib', 'pylab', 'tkinter']
+IMPORT_BUDGET = 1.0  # seconds, per module, in a fresh interpreter
+
+IMPORT_PROBE = """
+import sys, time
+sys.path.insert(0, %r)
+start = time.perf_counter()
+import landscape
+generated = []
+original_init = landscape.Landscape.__init__
+def counting_init(self, *args, **kwargs):
+    generated.append(1)
+    original_init(self, *args, **kwargs)
+landscape.Landscape.__init__ = counting_init
+import %s
+elapsed = time.perf_counter() - start
+plotting = [m for m in %r if m in sys.modules]
+print(elapsed, len(generated), ",".join(plotting))
+"""
+
+def importTimes(modules=HEADLESS_MODULES, budget=IMPORT_BUDGET):
+    ok = True
+    for module in modules:
+        probe = IMPORT_PROBE%(HERE, module, PLOTTING_MODULES)
+        result = subprocess.run([sys.executable, "-c", probe], capture_output=True, text=True)
+        if result.returncode != 0:
+            print("%20s: import failed\n%s"%(module, result.stderr))
+            ok = False
+            continue
+        elapsed, generated, plotting = result.stdout.split(" ")
+        elapsed = float(elapsed)
+        generated = int(generated)
+        plotting = plotting.strip()
+        passed = elapsed <= budget and generated == 0 and not plotting
+        print("%20s: %7.4f s, landscapes generated: %d, plotting modules: %s %s"%(
+              module, elapsed, generated, plotting or "none", "" if passed else "  <-- FAIL"))
+        ok = ok and passed
+    return ok
+
+"""
+household aggregate queries
+"""
+AGGREGATE_SIZES = [1000, 10000, 100000]  # foragers
+AGGREGATE_REPEATS = 5  # query rounds timed per size
+
+def walkMembers(hh):
+    # the per-call member walks that the running household aggregates replaced
+    members = []
+    members.extend(hh.parents)
+    members.extend(hh.children)
+    members.extend(hh.adoptees)
+    needs = 0
+    for member in members:
+        needs += member.foodRequired()
+    hungry = False
+    for m in members:
+        hungry = hungry or m.getHealth()<1.0
+    ability = 0
+    for forager in members:
+        if forager is not None:
+            ability += forager.foragingExpertise()
+    return needs, hungry, ability, len(hh.parents) + len(hh.children) + len(hh.adoptees)
+
+def readAggregates(hh):
+    hh.members()
+    return hh.determineFoodNeeds(), hh.isHungry(), hh.foragingAbility(), hh.size()
+
+def aggregates(sizes=AGGREGATE_SIZES, repeats=AGGREGATE_REPEATS):
+    import time
+    import world as W
+    import landscape as L
+    for size in sizes:
+        world = W.World(numagents=size//2, landscape=L.Landscape(seed=0))
+        timings = []
+        for query in [walkMembers, readAggregates]:
+            start = time.perf_counter()
+            for i in range(repeats):
+                for hh in world.households:
+                    query(hh)
+            timings.append((time.perf_counter() - start)/repeats)
+        walked, aggregated = timings
+        print("%7d foragers: member walks %8.5f s/round, aggregates %8.5f s/round, saving %8.5f s (%4.1fx)"%(
+              size, walked, aggregated, walked - aggregated, walked/aggregated))
+    return True
+
+"""
+memory per forager
+"""
+MEMORY_FORAGERS = 20000
+MEMORY_BUDGET = 400  # bytes per forager, including its pedigree row
+
+def allocatedPerForager(cls, world, count):
+    import tracemalloc
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    foragers = [cls(world, -1) for i in range(count)]
+    used = tracemalloc.get_traced_memory()[0] - start
+    tracemalloc.stop()
+    return used/len(foragers)
+
+def memoryPerForager(count=MEMORY_FORAGERS, budget=MEMORY_BUDGET):
+    import world as W
+    import landscape as L
+    import forager as F
+    world = W.World(numagents=1, landscape=L.Landscape(seed=0))
+    class Ancestry(object):
+        def __init__(self, person, generations):
+            self.person = person
+            self.ancestors = [None, None]
+            self.past_length = generations
+    class LegacyForager(F.Forager):
+        # the layout Forager had before: a __dict__ (subclasses without __slots__ get one),
+        # the parents list and a per-forager Ancestry node
+        def __init__(self, world, age=0, parents=[], kinship_span=2):
+            super().__init__(world, age, parents, kinship_span)
+            self.parents = parents
+            self.ancestry = Ancestry(self, self.kinship_span)
+    slotted = allocatedPerForager(F.Forager, world, count)
+    legacy = allocatedPerForager(LegacyForager, world, count)
+    passed = slotted <= budget
+    print("memory per forager: %6.1f bytes slotted, %6.1f bytes in the old layout (%3.1fx) %s"%(
+          slotted, legacy, legacy/slotted, "" if passed else "  <-- FAIL"))
+    return passed
+
+"""
+array engine
+"""
+EQUIVALENCE_CONFIGS = [{}, {'grn': True}, {'brn': True}, {'communal': True, 'grn': True, 'brn': True}]
+EQUIVALENCE_SEEDS = list(range(1, 25))
+EQUIVALENCE_STEPS = 150
+NOT_COMPARED = ["runtime", "stop cond."]
+# a Hoover index is within [0, 1] whenever storage is never negative
+VALID_RANGES = {"avg avg hoover": (0, 1), "avg max hoover": (0, 1)}
+
+def engineOutputs(engine, config, seeds, steps):
+    import world as W
+    import hhagent as HH
+    import forage_experiment as FE
+    W.setEngine(engine)
+    HH.setGRNHelp(config.get('grn', False))
+    HH.setBRNHelp(config.get('brn', False))
+    HH.setCommunalSharing(config.get('communal', False))
+    experiment = FE.ForageExperiment()
+    experiment.setupOutputs()
+    experiment.sim_runtime = steps
+    experiment.metrics_start = steps//2
+    outputs = []
+    for seed in seeds:
+        W.setRandomSeed(seed)
+        experiment.landscape_seed = seed
+        experiment.initiateSim()
+        while not experiment.stopSim():
+            experiment.stepSim()
+        outputs.append(experiment.getOutputs())
+    W.setEngine()
+    W.setRandomSeed()
+    HH.setGRNHelp()
+    HH.setBRNHelp()
+    HH.setCommunalSharing()
+    return outputs
+
+def engineEquivalence(configs=EQUIVALENCE_CONFIGS, seeds=EQUIVALENCE_SEEDS, steps=EQUIVALENCE_STEPS):
+    """
+    The array engine does not reproduce the object engine's trajectories, only its statistics: for
+    every forage_experiment output, the means over the seeds must agree within 3 standard errors
+    of their difference, and the Hoover indices of both must be valid.
+    """
+    import math
+    import utility as U
+    ok = True
+    for config in configs:
+        expected = engineOutputs('object', config, seeds, steps)
+        actual = engineOutputs('array', config, seeds, steps)
+        print("config %s:"%(config or "no sharing"))
+        for name in expected[0]:
+            if name in NOT_COMPARED:
+                continue
+            object_values = [outputs[name] for outputs in expected]
+            array_values = [outputs[name] for outputs in actual]
+            low, high = VALID_RANGES.get(name, (-math.inf, math.inf))
+            if not all([low <= value <= high for value in object_values + array_values]):
+                print("%20s: out of range  <-- FAIL"%name)
+                ok = False
+                continue
+            object_mean = U.mean(object_values)
+            array_mean = U.mean(array_values)
+            error = math.sqrt((U.standardDeviation(object_values)**2 + U.standardDeviation(array_values)**2)/len(seeds))
+            difference = abs(array_mean - object_mean)
+            z = difference/error if error else (math.inf if difference else 0)
+            passed = z <= 3
+            print("%20s: object %10.4f, array %10.4f, z %4.2f%s"%(name, object_mean, array_mean, z, "" if passed else "  <-- FAIL"))
+            ok = ok and passed
+    return ok
+
+SPEED_WIDTH = 180        # a landscape that holds more than 10k foragers
+SPEED_FOUNDERS = 5000    # households, two foragers each
+SPEED_STEPS = 10
+# minimum speedup of the array engine over the object engine; it measures 1.4-1.7x.  Households
+# must still act one at a time, and that loop is interpreted Python in both engines.
+SPEED_FLOOR = 1.3
+
+def engineSpeed(width=SPEED_WIDTH, founders=SPEED_FOUNDERS, steps=SPEED_STEPS, floor=SPEED_FLOOR):
+    import time
+    import landscape as L
+    import world as W
+    import hhagent as HH
+    default_width = L.width
+    default_move_cost = HH.fractional_move_cost
+    L.width = width
+    HH.fractional_move_cost = HH.move_cost/width  # as hhagent derives it from the default width
+    HH.setBRNHelp(True)
+    rates = {}
+    for engine in ['object', 'array']:
+        W.setRandomSeed(0)
+        world = W.World(numagents=founders, landscape=L.Landscape(seed=0), engine=engine)
+        start = time.perf_counter()
+        for i in range(steps):
+            world.step()
+        rates[engine] = steps/(time.perf_counter() - start)
+        print("%7s engine: %6.3f steps/s, %d foragers after %d steps"%(engine, rates[engine], world.population, steps))
+    L.width = default_width
+    HH.fractional_move_cost = default_move_cost
+    HH.setBRNHelp()
+    W.setRandomSeed()
+    speedup = rates['array']/rates['object']
+    passed = speedup >= floor
+    print("array engine speedup: %4.1fx %s"%(speedup, "" if passed else "  <-- FAIL"))
+    return passed
+
+REPRODUCIBILITY_STEPS = 40
+
+def reproducibility(steps=REPRODUCIBILITY_STEPS):
+    """
+    Worlds seeded from the same root seed, job and repetition must run identically, whatever
+    ran before them in the process; another repetition must run differently.
+    """
+    import random
+    import landscape as L
+    import world as W
+    import hhagent as HH
+    import streams as R
+    HH.setBRNHelp(True)
+    histories = {}
+    for engine in ['object', 'array']:
+        for repetition in [0, 1, 0]:
+            random.seed(repetition)  # the global generator must make no difference
+            world = W.World(landscape=L.Landscape(seed=0), engine=engine, streams=R.RandomStreams(7, 3, repetition))
+            for i in range(steps):
+                world.step()
+            history = (world.populations, world.avg_hoover, world.food_shared)
+            histories.setdefault((engine, repetition), []).append(history)
+    HH.setBRNHelp()
+    ok = True
+    for engine in ['object', 'array']:
+        repeated = histories[engine, 0][0] == histories[engine, 0][1]
+        varied = histories[engine, 0][0] != histories[engine, 1][0]
+        print("%7s engine: repetition rerun identically %s, other repetition differs %s"%(engine, repeated, varied))
+        ok = ok and repeated and varied
+    return ok
+
+INTERLEAVED_CONFIGS = [('object', {'brn_help': True}), ('object', {'grn_help': True, 'birth_rate': 0.8}),
+                       ('array', {'communal_sharing': True})]
+
+def interleavedWorlds(configs=INTERLEAVED_CONFIGS, steps=REPRODUCIBILITY_STEPS):
+    """
+    Worlds with different configurations, stepped in turn in one process, must each run exactly
+    as they do alone.
+    """
+    import config as C
+    import landscape as L
+    import world as W
+    import streams as R
+    landscape = L.Landscape(seed=0)
+    def makeWorlds():
+        return [W.World(landscape=landscape, engine=engine, config=C.default()._replace(**changes),
+                        streams=R.RandomStreams(11, job)) for job, (engine, changes) in enumerate(configs)]
+    alone = []
+    for world in makeWorlds():
+        for i in range(steps):
+            world.step()
+        alone.append(world)
+    together = makeWorlds()
+    for i in range(steps):
+        for world in together:
+            world.step()
+    ok = True
+    for (engine, changes), a, b in zip(configs, alone, together):
+        same = (a.populations, a.avg_hoover, a.food_shared) == (b.populations, b.avg_hoover, b.food_shared)
+        print("%7s engine %s: interleaved run identical to a run alone %s"%(engine, changes, same))
+        ok = ok and same
+    return ok
+
+RECORDED_METRICS = ['population', 'median_storage', 'avg_food_stored', 'max_hoover', 'avg_hoover', 'brn_sharing']
+RECORDER_START = 10
+RECORDER_INTERVAL = 3
+
+def metricsRecorder(steps=REPRODUCIBILITY_STEPS, names=RECORDED_METRICS, start=RECORDER_START,
+                    interval=RECORDER_INTERVAL):
+    """
+    A recorder's samples must equal the entries for the same steps in the lists a world without a
+    recorder keeps.  The timings show what skipping the unrequested metrics saves.
+    """
+    import time
+    import landscape as L
+    import world as W
+    import hhagent as HH
+    import metrics as M
+    import streams as R
+    HH.setBRNHelp(True)
+    landscape = L.Landscape(seed=0)
+    recorders = {'every metric': None, 'selected metrics': M.MetricsRecorder(steps),
+                 'population only': M.MetricsRecorder(steps)}
+    for name in names:
+        recorders['selected metrics'].request(name, start, interval)
+    recorders['population only'].request('population', start, interval)
+    worlds = {}
+    for mode, recorder in recorders.items():
+        world = worlds[mode] = W.World(landscape=landscape, streams=R.RandomStreams(5), recorder=recorder)
+        begin = time.perf_counter()
+        for i in range(steps):
+            world.step()
+        print("%16s: %6.3f s"%(mode, time.perf_counter() - begin))
+    HH.setBRNHelp()
+    ok = True
+    legacy = worlds['every metric']
+    recorder = recorders['selected metrics']
+    for name in names:
+        # the lists that start with an entry for step 0 are indexed by step, the others by step - 1
+        series = {'population': legacy.populations, 'median_storage': legacy.median_storage}.get(name)
+        if series is None:
+            series = [None] + getattr(legacy, name)
+        same = recorder.values(name).tolist() == [series[step] for step in recorder.sampledSteps(name)]
+        print("%16s: recorded samples equal the world's list %s"%(name, same))
+        ok = ok and same
+    return ok
+
+KERNEL_SIZES = [300, 5000]
+KERNEL_GROUPS = 500
+
+def inequalityKernels(sizes=KERNEL_SIZES, groups=KERNEL_GROUPS):
+    """
+    The array kernels utility routes long lists to must give exactly what the list code gives,
+    and the grouped kernels what the list code gives for each group.
+    """
+    import random
+    import time
+    import numpy
+    import utility as U
+    rng = random.Random(0)
+    functions = [U.variance, U.standardDeviation, U.median, U.HooverIndex, U.GiniIndex]
+    ok = True
+    for size in sizes:
+        values = [rng.random()*10 for i in range(size)]
+        default_size = U.fast_path_size
+        timings = {}
+        results = {}
+        for mode, fast_path_size in [('lists', size + 1), ('arrays', default_size)]:
+            U.setFastPathSize(fast_path_size)
+            start = time.perf_counter()
+            results[mode] = [function(values) for function in functions]
+            timings[mode] = time.perf_counter() - start
+        U.setFastPathSize(default_size)
+        same = results['lists'] == results['arrays']
+        print("%6d values: list code %8.5f s, kernels %8.5f s, identical %s"%(size, timings['lists'], timings['arrays'], same))
+        ok = ok and same
+    values = numpy.array([rng.random() for i in range(20*groups)])
+    labels = numpy.array([rng.randrange(groups) for i in range(20*groups)])
+    U.setFastPathSize(len(values) + 1)  # the list code, for the reference values
+    for grouped, function in [(U.groupedStandardDeviation, U.standardDeviation), (U.groupedMedian, U.median),
+                              (U.groupedHoover, U.HooverIndex), (U.groupedGini, U.GiniIndex)]:
+        groups_found, computed = grouped(values, labels)
+        expected = [function(values[labels == label].tolist()) for label in groups_found]
+        same = numpy.allclose(computed, expected, rtol=1e-12, atol=1e-12)
+        print("%25s: equal to %s per group %s"%(grouped.__name__, function.__name__, same))
+        ok = ok and same
+    U.setFastPathSize()
+    return ok
+
+SNAPSHOT_CONFIGS = [('object', {'brn_help': True, 'pooling': True}), ('object', {'grn_help': True}),
+                    ('array', {'brn_help': True})]
+
+def snapshots(configs=SNAPSHOT_CONFIGS, steps=REPRODUCIBILITY_STEPS):
+    """
+    A world restored from a snapshot taken halfway through a run must finish the run exactly as
+    the world that was saved does.
+    """
+    import tempfile
+    import time
+    import config as C
+    import landscape as L
+    import metrics as M
+    import world as W
+    import streams as R
+    landscape = L.Landscape(seed=0)
+    ok = True
+    for engine, changes in configs:
+        recorder = M.MetricsRecorder(steps)
+        recorder.request('avg_prestige', 1, 2)
+        world = W.World(landscape=landscape, engine=engine, config=C.default()._replace(**changes),
+                        streams=R.RandomStreams(13), recorder=recorder)
+        for i in range(steps//2):
+            world.step()
+        path = os.path.join(tempfile.mkdtemp(), 'snapshot.npz')
+        start = time.perf_counter()
+        world.save_snapshot(path)
+        saved = time.perf_counter() - start
+        start = time.perf_counter()
+        restored = W.World.load_snapshot(path)
+        loaded = time.perf_counter() - start
+        size = os.path.getsize(path)
+        os.remove(path)
+        for i in range(steps - steps//2):
+            world.step()
+            restored.step()
+        same = ((world.populations, world.avg_hoover, world.food_shared, world.ages_at_death.counts)
+                == (restored.populations, restored.avg_hoover, restored.food_shared, restored.ages_at_death.counts)
+                and world.recorder.values('avg_prestige').tolist() == restored.recorder.values('avg_prestige').tolist())
+        print("%7s engine %s: %7d bytes, saved in %6.3f s, loaded in %6.3f s, restored run identical %s"
+              %(engine, changes, size, saved, loaded, same))
+        ok = ok and same
+    return ok
+
+BRANCH_VARIANTS = [{}, {'brn_help': True}, {'grn_help': True, 'birth_rate': 0.8}]
+
+def warmStarts(variants=BRANCH_VARIANTS, steps=REPRODUCIBILITY_STEPS):
+    """
+    A world run for half the steps, saved, and restored once per variant, must carry on exactly as
+    if it had been stepped on, or reconfigured without a restore, under that variant's parameters.
+    The timings compare running the shared half once with running every variant from the start.
+    An experiment must refuse a branch parameter that a world can't take part way through a run.
+    """
+    import tempfile
+    import time
+    import config as C
+    import landscape as L
+    import world as W
+    import streams as R
+    landscape = L.Landscape(seed=0)
+    ok = True
+    for engine in ['object', 'array']:
+        def makeWorld():
+            return W.World(landscape=landscape, engine=engine, streams=R.RandomStreams(17))
+        start = time.perf_counter()
+        expected = []
+        for changes in variants:
+            world = makeWorld()
+            for i in range(steps):
+                if i == steps//2:
+                    world.reconfigure(world.config._replace(**changes))
+                world.step()
+            expected.append(world.populations)
+        unbranched = time.perf_counter() - start
+        start = time.perf_counter()
+        world = makeWorld()
+        for i in range(steps//2):
+            world.step()
+        path = os.path.join(tempfile.mkdtemp(), 'prefix.npz')
+        world.save_snapshot(path)
+        branched = []
+        for changes in variants:
+            world = W.World.load_snapshot(path)
+            world.reconfigure(world.config._replace(**changes))
+            for i in range(steps - steps//2):
+                world.step()
+            branched.append(world.populations)
+        os.remove(path)
+        elapsed = time.perf_counter() - start
+        same = branched == expected
+        try:
+            world.reconfigure(world.config._replace(width=world.config.width + 1))
+            refused = False
+        except ValueError:
+            refused = True
+        print("%7s engine: %d variants from the start %6.3f s, branched %6.3f s, identical %s, fixed parameter refused %s"
+              %(engine, len(variants), unbranched, elapsed, same, refused))
+        ok = ok and same and refused
+    experiment = smallExperiment(tempfile.mkdtemp(), steps, branch_step=steps//2)
+    experiment.setupExperiment()
+    experiment.addParameter(L.setGridLength, [2, 3], branch=True)
+    try:
+        experiment.setupDesign()
+        refused = False
+    except ValueError:
+        refused = True
+    print("experiment: branch parameter the world can't take refused %s"%refused)
+    return ok and refused
+
+PARALLEL_WORKERS = 2
+PARALLEL_STEPS = 30
+
+def smallExperiment(directory, steps, variants=(False, True), **settings):
+    """ A short ForageExperiment, with a job for each of the variants of BRN help, with the given attributes set. """
+    import contextlib
+    import io
+    import forage_experiment as FE
+    import hhagent as HH
+    class SmallExperiment(FE.ForageExperiment):
+        def setupExperiment(self):
+            super().setupExperiment()
+            self.addParameter(HH.setBRNHelp, list(variants))
+            self.sim_runtime = steps
+            self.metrics_start = steps//3
+        def setupFile(self):
+            self.fileName = os.path.join(directory, "small experiment.csv")
+    with contextlib.redirect_stdout(io.StringIO()):
+        experiment = SmallExperiment()
+    for name, value in settings.items():
+        setattr(experiment, name, value)
+    return experiment
+
+def runSmallExperiment(directory, steps, **settings):
+    """ Runs smallExperiment; returns its file, less the time stamps. """
+    import contextlib
+    import io
+    experiment = smallExperiment(directory, steps, **settings)
+    with contextlib.redirect_stdout(io.StringIO()):
+        experiment.run()
+    with open(experiment.fileName) as f:
+        contents = [line for line in f if not line.startswith(("Experiment started", "Experiment Completed"))]
+    os.remove(experiment.fileName)
+    return contents
+
+def checkpointResumes(steps=PARALLEL_STEPS):
+    """
+    An experiment run again with resume set must carry on from its checkpoints, and write the same
+    file; repetitions whose checkpoints were saved under another seed, or before the design changed,
+    must start again.
+    """
+    import contextlib
+    import io
+    import tempfile
+    import world as W
+    directory = tempfile.mkdtemp()
+    checkpoints = os.path.join(directory, "checkpoints")
+    def run(seed, variants):
+        # the number of repetitions started afresh, and the file written
+        W.setRandomSeed(seed)
+        experiment = smallExperiment(directory, steps, variants, resume=True, checkpoint_interval=steps,
+                                     checkpoint_directory=checkpoints)
+        starts = []
+        initiateSim = experiment.initiateSim
+        experiment.initiateSim = lambda: starts.append(None) or initiateSim()
+        with contextlib.redirect_stdout(io.StringIO()):
+            experiment.run()
+        with open(experiment.fileName) as f:
+            contents = [line for line in f if not line.startswith(("Experiment started", "Experiment Completed"))]
+        os.remove(experiment.fileName)
+        return len(starts), contents
+    saved, saved_file = run(19, [False, True])
+    resumed, resumed_file = run(19, [False, True])
+    reseeded, reseeded_file = run(20, [False, True])
+    redesigned, redesigned_file = run(20, [True, False])
+    W.setRandomSeed(None)
+    carried_on = resumed == 0 and resumed_file == saved_file
+    restarted = reseeded == redesigned == saved
+    print("resumed from every checkpoint %s, identical output %s, restarted under another seed or design %s"
+          %(resumed == 0, resumed_file == saved_file, restarted))
+    return carried_on and restarted
+
+def parallelExperiment(workers=PARALLEL_WORKERS, steps=PARALLEL_STEPS):
+    """
+    An experiment whose repetitions run in worker processes must write exactly the file a serial
+    run writes.  How much faster it runs depends on the cores available.
+    """
+    import tempfile
+    import time
+    import world as W
+    directory = tempfile.mkdtemp()
+    W.setRandomSeed(19)
+    contents = {}
+    timings = {}
+    for count in [1, workers]:
+        start = time.perf_counter()
+        contents[count] = runSmallExperiment(directory, steps, workers=count)
+        timings[count] = time.perf_counter() - start
+    W.setRandomSeed(None)
+    same = contents[1] == contents[workers]
+    print("serial %6.3f s, %d workers %6.3f s (%s cores), identical output %s"
+          %(timings[1], workers, timings[workers], os.cpu_count(), same))
+    return same
+
+def experimentLandscapes():
+    """
+    Every run of an experiment must get the same landscape, derived from its root seed: unseeded
+    experiments must get landscapes of their own, and experiments with the same seed the same one,
+    unless landscape_seed fixes it.
+    """
+    import tempfile
+    import world as W
+    directory = tempfile.mkdtemp()
+    first, second = smallExperiment(directory, 0), smallExperiment(directory, 0)
+    unseeded = first.landscapeSeed() == first.landscapeSeed() != second.landscapeSeed()
+    W.setRandomSeed(19)
+    first, second = smallExperiment(directory, 0), smallExperiment(directory, 0)
+    seeded = first.landscapeSeed() == second.landscapeSeed()
+    second.landscape_seed = 0
+    fixed = second.landscapeSeed() == 0
+    W.setRandomSeed(None)
+    print("one landscape per unseeded experiment %s, shared by the same seed %s, fixed by landscape_seed %s"
+          %(unseeded, seeded, fixed))
+    return unseeded and seeded and fixed
+
+def jobQueue(steps=PARALLEL_STEPS):
+    """
+    An experiment run through a job queue must write exactly the file a serial run writes, and
+    running it again must take its results from the queue.  A worker started without the root seed
+    and engine must take them from the queued tasks.  An unseeded experiment must run again from its
+    queue under the root seed it was first queued with, leaving the world's seed unset.  A task whose
+    lease expires must go to the next worker, and only the first result for it is kept; a failed task
+    must be retried when it is submitted again.
+    """
+    import contextlib
+    import json
+    import sqlite3
+    import tempfile
+    import time
+    import jobqueue as JQ
+    import world as W
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, "queue.db")
+    W.setRandomSeed(19)
+    serial = runSmallExperiment(directory, steps)
+    start = time.perf_counter()
+    queued = runSmallExperiment(directory, steps, queue_path=path)
+    elapsed = time.perf_counter() - start
+    start = time.perf_counter()
+    requeued = runSmallExperiment(directory, steps, queue_path=path)
+    again = time.perf_counter() - start
+    W.setRandomSeed(None)
+    W.setEngine('array')
+    worker = smallExperiment(directory, steps)
+    worker.setupExperiment()
+    worker.setupDesign()
+    with contextlib.closing(sqlite3.connect(path)) as db:
+        spec = json.loads(db.execute("SELECT spec FROM tasks WHERE task = 0").fetchone()[0])
+    worker.specGroup(spec)
+    settings = (worker.rootSeed(), W.random_seed, W.simulation_engine) == (19, None, 'object')
+    W.setEngine()
+    os.remove(path)
+    unseeded = runSmallExperiment(directory, steps, queue_path=path)
+    unseeded_again = runSmallExperiment(directory, steps, queue_path=path)
+    rerun = unseeded == unseeded_again and W.random_seed is None
+    crashed = JQ.JobQueue(path, lease_time=0, worker="crashed")
+    survivor = JQ.JobQueue(path, worker="survivor")
+    crashed.submit("leases", [{"task": 0}])
+    first = crashed.lease("leases")
+    second = survivor.lease("leases")  # the crashed worker's lease has already expired
+    survivor.complete("leases", 0, "survivor's result")
+    crashed.complete("leases", 0, "late result")
+    retried = first == second == (0, {"task": 0}) and survivor.results("leases") == ["survivor's result"]
+    survivor.submit("failures", [{"task": 0}])
+    task, spec = survivor.lease("failures")
+    survivor.fail("failures", task, "failed")
+    survivor.submit("failures", [{"task": 0}])
+    resubmitted = survivor.lease("failures") == (0, {"task": 0})
+    os.remove(path)
+    same = serial == queued == requeued
+    print("queued run %6.3f s, rerun from the queue %6.3f s, identical output %s, settings taken from the queue %s, "
+          "unseeded rerun from the queue %s, expired lease retried %s, failed task resubmitted %s"
+          %(elapsed, again, same, settings, rerun, retried, resubmitted))
+    return same and settings and rerun and retried and resubmitted
+
+LEDGER_STEPS = 60
+
+def debtLedger(steps=LEDGER_STEPS):
+    """
+    Every household's prestige in the ledger must be the net amount owed to it, also after the
+    households it dealt with have left the world.
+    """
+    import random
+    import config as C
+    import landscape as L
+    import ledger as D
+    import world as W
+    import streams as R
+    def consistent(ledger):
+        return all(abs(ledger.prestigeOf(ID) + sum(debts.values())) < 1e-9 for ID, debts in ledger.owed.items()) \
+            and all(ID in ledger.owed for ID in ledger.prestige)
+    ledger = D.DebtLedger()
+    for debtor, creditor, amount in [(1, 2, 5), (1, 3, 2), (3, 2, 1)]:
+        ledger.record(debtor, creditor, amount)
+    ledger.remove(1)
+    small = consistent(ledger) and ledger.prestige == {2: 1, 3: -1}
+    rng = random.Random(0)
+    ledger = D.DebtLedger()
+    random_ok = True
+    for i in range(2000):
+        debtor, creditor = rng.sample(range(50), 2)
+        ledger.record(debtor, creditor, rng.random())
+        if i % 20 == 0:
+            ledger.remove(rng.randrange(50))
+            random_ok = random_ok and consistent(ledger)
+    world_ok = True
+    world = W.World(landscape=L.Landscape(seed=0), config=C.default()._replace(brn_help=True),
+                    streams=R.RandomStreams(23))
+    for i in range(steps):
+        world.step()
+        world_ok = world_ok and consistent(world.ledger)
+    print("prestige equals the net amount owed after removals: example %s, random ledger %s, BRN world %s (%d houses gone)"
+          %(small, random_ok, world_ok, world.dead_houses - 1))
+    return small and random_ok and world_ok
+
+def gcSchedule(steps=REPRODUCIBILITY_STEPS):
+    """
+    A world must leave the garbage collector alone unless told to schedule it, and give it back as
+    it found it when closed.
+    """
+    import gc
+    import config as C
+    import landscape as L
+    import world as W
+    import streams as R
+    landscape = L.Landscape(seed=0)
+    ok = True
+    for enabled in [True, False]:
+        for interval, freeze in [(0, False), (5, True)]:
+            if enabled:
+                gc.enable()
+            else:
+                gc.disable()
+            world = W.World(landscape=landscape, config=C.default()._replace(gc_interval=interval, gc_freeze=freeze),
+                            streams=R.RandomStreams(29))
+            untouched = gc.isenabled() == (enabled and interval == 0)
+            for i in range(steps//4):
+                world.step()
+            world.close()
+            restored = gc.isenabled() == enabled and gc.get_freeze_count() == 0
+            print("collector %s, interval %d, freeze %s: %s during the run %s, restored when closed %s"
+                  %("on" if enabled else "off", interval, freeze, "left alone" if interval == 0 else "scheduled",
+                    untouched, restored))
+            ok = ok and untouched and restored
+    gc.enable()
+    return ok
+
+CHECKS = [importTimes, aggregates, memoryPerForager, engineEquivalence, engineSpeed, reproducibility,
+          interleavedWorlds, metricsRecorder, inequalityKernels, snapshots, warmStarts, parallelExperiment,
+          checkpointResumes, experimentLandscapes, jobQueue, debtLedger, gcSchedule]
+
+"""
+MAIN
+"""
+if __name__ == '__main__':
+    results = [check() for check in CHECKS]
+    sys.exit(0 if all(results) else 1)
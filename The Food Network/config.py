@@ -0,0 +1,80 @@
+""" config.py
+A world's parameters, as one immutable value.
+
+The setters in world, hhagent, forager and landscape (setMinResource,
+setBRNHelp, setAvgForagingExpertise, ...) still set module globals; those
+globals are the default configuration.  Each World takes a snapshot of them
+(default()) when it is created, or is given a SimConfig of its own, and its
+households and foragers read their parameters from world.config only.  Worlds
+with different configurations can then be created and stepped side by side in
+one process, and changing a setter never affects a world that already exists.
+
+A variant of a configuration is made with _replace, as with any namedtuple:
+
+    config = C.default()._replace(brn_help=True, birth_rate=0.8)
+
+A world that already exists only takes a new configuration that differs from
+its own in BRANCHABLE parameters (see World.reconfigure).
+"""
+
+import collections
+import importlib
+
+# the parameters of each module that make up a configuration
+PARAMETERS = collections.OrderedDict([
+    ('world', ['starting_agents', 'min_resource', 'max_resource', 'regrowth_steps',
+               'min_founder_kin_span', 'max_founder_kin_span', 'pooling', 'gc_interval',
+               'gc_freeze', 'simulation_engine', 'random_seed']),
+    ('hhagent', ['subsistence_threshold', 'birth_rate', 'move_cost', 'fractional_move_cost',
+                 'communal_sharing', 'grn_help', 'brn_help']),
+    ('forager', ['avg_foraging_expertise', 'stddev_foraging_expertise', 'full_ancestry']),
+    ('landscape', ['width']),
+])
+
+# the parameters households and foragers look up every time they act, so that a world can carry on
+# under new values part way through a run (World.reconfigure); the others shape the world when it is
+# created (or, like full_ancestry, are built into cached kin sets) and stay fixed for its lifetime
+BRANCHABLE = frozenset(['subsistence_threshold', 'birth_rate', 'move_cost', 'fractional_move_cost',
+                        'communal_sharing', 'grn_help', 'brn_help', 'avg_foraging_expertise',
+                        'stddev_foraging_expertise'])
+
+class SimConfig(collections.namedtuple('SimConfig', [name for names in PARAMETERS.values() for name in names])):
+
+    __slots__ = ()
+
+    def homogeneous(self):
+        # forager.homogeneous for this configuration
+        return self.stddev_foraging_expertise==0
+
+def default():
+    """ The configuration the module globals currently describe. """
+    values = {}
+    for module_name, names in PARAMETERS.items():
+        module = importlib.import_module(module_name)
+        for name in names:
+            values[name] = getattr(module, name)
+    return SimConfig(**values)
+
+def restore(config):
+    """ Sets the module globals back to config. """
+    for module_name, names in PARAMETERS.items():
+        module = importlib.import_module(module_name)
+        for name in names:
+            setattr(module, name, getattr(config, name))
+
+def changedBy(setter, values):
+    """
+    The parameters of the configuration that setter changes when called with any of values; the
+    module globals are left as they were.  A setter of a global that is not a parameter changes none.
+    """
+    before = default()
+    changed = set()
+    try:
+        for value in values:
+            setter(value)
+            after = default()
+            changed |= set(name for name in SimConfig._fields if getattr(after, name) != getattr(before, name))
+            restore(before)
+    finally:
+        restore(before)
+    return changed
@@ -1,7 +1,14 @@
 import utility as U
 import datetime as DT
+import jobqueue as JQ
 import collections
+import hashlib
+import json
+import multiprocessing
+import os
 import sys
+import time
+import traceback
 
 
 """  
@@ -24,6 +31,16 @@ Modify the run() method if you need more.
 
 - Vince Kane, 29 Nov 2013
 """
+worker_experiment = None  # the experiment a worker process runs tasks for
+
+def initWorker(experiment):
+    global worker_experiment
+    worker_experiment = experiment
+
+def runWorkerTask(task):
+    group, repetition = task
+    return worker_experiment.runTask(group, repetition)
+
 class Experiment(object):
     
     """ 
@@ -41,6 +58,68 @@ class Experiment(object):
         """ A dictionary of string formats that tells the fileWriteOutput method how to format the output values"""
         self.output_formats = collections.OrderedDict()
         self.fileName = ""
+        """ The job and repetition being run, for seeding each repetition's random number streams """
+        self.job_id = 0
+        self.repetition = 0
+        """
+        Checkpointing: every checkpoint_interval steps (0 for never), and at the end of each repetition,
+        simSaveFunc(path) saves the simulation to a file in checkpoint_directory.  With resume set, a
+        repetition that has a checkpoint is restored with simLoadFunc(path) and carries on from there,
+        so an interrupted experiment can be run again without redoing the steps already taken.  The
+        file is named by a digest of the job's parameters and the defaults, so a checkpoint saved before
+        the design changed is not found; simResumableFunc(), if set, tells whether the restored
+        simulation was saved under the settings now current, and one that wasn't starts again.
+        """
+        self.checkpoint_interval = 0
+        self.checkpoint_directory = "checkpoints"
+        self.resume = False
+        self.simSaveFunc = None
+        self.simLoadFunc = None
+        self.simResumableFunc = None
+        self.current_job = None  # the job whose parameters were applied last
+        """ simEndFunc(), if set, is called once a simulation's outputs have been taken, to release what it holds """
+        self.simEndFunc = None
+        """
+        Branching: jobs that differ only in parameters added with branch=True share their first
+        branch_step steps, which are run once per repetition with the parameters (branch parameters
+        included) and random number streams of the first job of the group, saved with simSaveFunc, and
+        restored with simLoadFunc for each job of the group.  simBranchFunc is then called, with the
+        job's parameters set, to carry the restored simulation on under them; so a job's own values of
+        the branch parameters take effect after branch_step steps, and the first job's values hold
+        until then.  simBranchableFunc(setter, values), if set, tells whether the simulation can take
+        new values from setter part way through a run; setupDesign rejects branch parameters it can't.
+        shared_prefixes records, for every job, the job whose prefix it was branched from.
+        """
+        self.branch_step = None
+        self.branch_setters = []
+        self.simBranchFunc = None
+        self.simBranchableFunc = None
+        self.shared_prefixes = collections.OrderedDict()  # job ID -> ID of the job whose prefix it shares
+        """
+        Worker processes: with workers > 1 (or None, for one per CPU), repetitions run in a pool of that
+        many forked processes.  Their outputs come back to this process and are written in the same
+        job and repetition order, with the same averages and standard deviations, as a serial run.
+        """
+        self.workers = 1
+        """
+        Job queue: with queue_path set to a SQLite file, the tasks are queued there (see jobqueue.py), and
+        worker processes on any machine that shares the file can take them, with work(), alongside this
+        one.  The results are written here, in order, once every task is done.  Running the experiment
+        again with the same queue file only runs the tasks that are not done yet.
+        """
+        self.queue_path = None
+        self.queue_poll = 5  # seconds between checks on tasks other workers hold
+        self.queue_lease = JQ.LEASE_TIME  # seconds before the task of a worker that stopped renewing is retried
+        """
+        Settings: simSettingsFunc(queued) returns what runs depend on besides the parameters of the
+        design (a root seed, say), as a JSON-compatible dictionary, and simApplySettingsFunc(settings)
+        makes them current.  They are fixed once per experiment, before any run, and queued with every
+        task, so that workers started elsewhere run under the settings of the process that submitted
+        the tasks.  queued is the settings the experiment was queued under before, when it is run again
+        with the same queue file, and None otherwise.
+        """
+        self.simSettingsFunc = None
+        self.simApplySettingsFunc = None
         
     """
     Override this method in subclasses, with the sections completed.
@@ -84,7 +163,7 @@ class Experiment(object):
         # with parameter values of 100 and 200.  
         """
         
-        """ 
+        """
         Section 3.5 - Number of repetitions per job.
         """
         self.job_repetitions = 1
@@ -102,7 +181,9 @@ class Experiment(object):
         # and the header "Avg Pop." will be written to the file
         """
           
-    def addParameter(self, setterMethod, values):
+    def addParameter(self, setterMethod, values, branch=False):
+        if branch:
+            self.branch_setters.append(setterMethod)
         if not isinstance(values, list):
             self.defaults[setterMethod] = values
         elif len(values)==1:
@@ -128,13 +209,18 @@ class Experiment(object):
             for setter in self.defaults:
                 self.paramSetters[setter] = [self.defaults[setter]]
         
+    def checkBranchParameters(self):
+        for setter in self.branch_setters:
+            if (setter in self.paramSetters and self.simBranchableFunc is not None
+                    and not self.simBranchableFunc(setter, self.paramSetters[setter])):
+                raise ValueError("%s can't be a branch parameter: the simulation can't take its values part way "
+                                 "through a run"%setter.__name__)
+        
     def run(self):
         self.setupExperiment()
         self.setupOutputs()
         self.setupFile()
-        self.checkParameters()
-        self.setDefaults()
-        self.design = self.full_factorial_design(self.paramSetters, job_id_name = "job_id")
+        self.setupDesign()
         self.filewriteParameters()
         try:
             self.simulate()
@@ -148,34 +234,248 @@ class Experiment(object):
             self.output("\n######################################################\n\n")
             self.outputFile.close()
         
+    def setupDesign(self):
+        self.checkParameters()
+        self.checkBranchParameters()
+        self.setDefaults()
+        self.design = self.full_factorial_design(self.paramSetters, job_id_name = "job_id")
+    
+    def work(self):
+        """
+        Works on the tasks of this experiment queued at queue_path by run() in another process,
+        until there are none left to take.  Results are kept in the queue, not written here.
+        """
+        self.setupExperiment()
+        self.setupOutputs()
+        self.fileName = os.devnull
+        self.setupDesign()
+        self.workOn(JQ.JobQueue(self.queue_path, self.queue_lease))
+        
     def simulate(self):
+        if self.branching():
+            groups = self.prefixGroups()
+        else:
+            groups = [[job] for job in self.design]
+        # one task per repetition of each group of jobs that share a prefix (of each job, without branching)
+        tasks = [(group, i) for group in groups for i in range(self.job_repetitions)]
+        results = self.runTasks(tasks)
+        for group in groups:
+            repetitions = [next(results) for i in range(self.job_repetitions)]
+            for k, job in enumerate(group):
+                self.job_id = job["job_id"]
+                self.setJobParameters(job)
+                if self.branching():
+                    self.shared_prefixes[job["job_id"]] = group[0]["job_id"]
+                    self.output("\nbranched from job %d after %d steps"%(group[0]["job_id"], self.branch_step))
+                job_outputs = self.newJobOutputs()
+                for outputs in repetitions:
+                    self.recordOutputs(job_outputs, outputs[k])
+                self.fileWriteStatistics(job_outputs)
+    
+    def runTasks(self, tasks):
+        """ The outputs of the tasks, in the order of the tasks, computed here or by a pool of worker processes. """
+        if self.queue_path is not None:
+            return self.runQueued(tasks)
+        self.fixSettings()  # before forking, so that every worker runs under them
+        workers = self.workers or os.cpu_count() or 1
+        if workers > 1 and len(tasks) > 1:
+            if "fork" in multiprocessing.get_all_start_methods():
+                return self.runInPool(tasks, min(workers, len(tasks)))
+            self.output("\nWorker processes need os.fork, which this platform lacks; running serially.")
+        return (self.runTask(group, repetition) for group, repetition in tasks)
+    
+    def runInPool(self, tasks, workers):
+        # forked workers inherit the experiment, so it is never pickled; only tasks and outputs are
+        with multiprocessing.get_context("fork").Pool(workers, initWorker, (self,)) as pool:
+            for outputs in pool.imap(runWorkerTask, tasks):
+                yield outputs
+    
+    def runQueued(self, tasks):
+        queue = JQ.JobQueue(self.queue_path, self.queue_lease)
+        first = queue.spec(self.Name, 0)  # queued by an earlier run of the experiment, if there was one
+        settings = self.fixSettings(first["settings"] if first is not None else None)
+        queue.submit(self.Name, [self.taskSpec(group, repetition, settings) for group, repetition in tasks])
+        while True:
+            self.workOn(queue)  # including tasks whose leases have expired
+            counts = queue.counts(self.Name)
+            if counts[JQ.FAILED]:
+                raise RuntimeError("queued tasks failed: %s"%(queue.failures(self.Name),))
+            if counts[JQ.DONE] == len(tasks):
+                break
+            time.sleep(self.queue_poll)
+        return iter([[collections.OrderedDict(outputs.items()) for outputs in group_outputs]
+                     for group_outputs in queue.results(self.Name)])
+    
+    def fixSettings(self, queued=None):
+        """ Makes the settings every run of the experiment shares current, and returns them. """
+        if self.simSettingsFunc is None:
+            return {}
+        settings = self.simSettingsFunc(queued)
+        if self.simApplySettingsFunc is not None:
+            self.simApplySettingsFunc(settings)
+        self.output("\nSettings: %s"%json.dumps(settings, sort_keys=True))
+        return settings
+    
+    def workOn(self, queue):
+        while True:
+            leased = queue.lease(self.Name)
+            if leased is None:
+                return
+            task, spec = leased
+            try:
+                with queue.holding(self.Name, task):
+                    group_outputs = self.runTask(self.specGroup(spec), spec["repetition"])
+            except Exception:
+                queue.fail(self.Name, task, traceback.format_exc())
+                continue
+            queue.complete(self.Name, task, group_outputs)
+    
+    def taskSpec(self, group, repetition, settings):
+        # what a worker needs to run the task, by setter name, so that it can be queued as JSON
+        return {"jobs": [{"job_id": job["job_id"], "parameters": self.jobParameters(job)} for job in group],
+                "repetition": repetition, "settings": settings}
+    
+    def jobParameters(self, job):
+        return collections.OrderedDict((setter.__name__, job[setter]) for setter in self.paramSetters)
+    
+    def specGroup(self, spec):
+        """ The jobs of the design a queued task runs, with the settings it was submitted under made current. """
+        jobs = dict((job["job_id"], job) for job in self.design)
+        group = []
+        for queued in spec["jobs"]:
+            job = jobs.get(queued["job_id"])
+            if job is None:
+                raise ValueError("job %d of the queue is not in this experiment's design of %d jobs"
+                                 %(queued["job_id"], len(self.design)))
+            parameters = json.loads(json.dumps(self.jobParameters(job)))
+            if parameters != queued["parameters"]:
+                differences = ["%s is %r in the queue but %r here"%(name, queued["parameters"].get(name), value)
+                               for name, value in parameters.items() if queued["parameters"].get(name) != value]
+                differences += ["%s is only in the queue"%name for name in queued["parameters"] if name not in parameters]
+                raise ValueError("job %d of the queue differs from this experiment's design: %s"
+                                 %(queued["job_id"], ", ".join(differences)))
+            group.append(job)
+        if self.simApplySettingsFunc is not None:
+            self.simApplySettingsFunc(spec["settings"])
+        return group
+    
+    def runTask(self, group, repetition):
+        """ Runs one repetition of a group of jobs that share a prefix, and returns the outputs of each job. """
+        self.job_id = group[0]["job_id"]
+        self.repetition = repetition
+        self.applyParameters(group[0])
+        if not self.branching():
+            self.runRepetition()
+            outputs = self.getOutputs()
+            self.endRun()
+            return [outputs]
+        path = self.checkpointPath(prefix=True)
+        self.runPrefix(path)
+        self.endRun()
+        group_outputs = []
+        for job in group:
+            self.applyParameters(job)
+            self.runBranch(path)
+            group_outputs.append(self.getOutputs())
+            self.endRun()
+        os.remove(path)
+        return group_outputs
+    
+    def endRun(self):
+        if self.simEndFunc is not None:
+            self.simEndFunc()
+    
+    def newJobOutputs(self):
+        job_outputs = collections.OrderedDict()  # a dictionary accessed by output variable name
+        # initialize empty lists to track repetition outputs for each output variable
+        for output in self.output_getters:
+            job_outputs[output] = []
+        return job_outputs
+    
+    def recordOutputs(self, job_outputs, outputs):
+        for output in outputs:
+            job_outputs[output].append(outputs[output])
+        self.outputFile.write("\n")
+        self.fileWriteOutputs(outputs)
+    
+    def fileWriteStatistics(self, job_outputs):
+        # write statistics to file
+        averages = collections.OrderedDict()
+        stddevs = collections.OrderedDict()
+        for variable in job_outputs:
+            averages[variable] = U.mean(job_outputs[variable])
+            stddevs[variable] = U.standardDeviation(job_outputs[variable])
+        self.output("\naverages: ")
+        self.fileWriteOutputs(averages)
+        self.output("\nstandard deviations: ")
+        self.fileWriteOutputs(stddevs)
+    
+    def branching(self):
+        return self.branch_step is not None and any(setter in self.paramSetters for setter in self.branch_setters)
+    
+    def prefixGroups(self):
+        """ The jobs of the design, grouped by the parameters that take effect before branch_step. """
+        groups = collections.OrderedDict()
         for job in self.design:
-            self.setJobParameters(job)
-            job_outputs = collections.OrderedDict()  # a dictionary accessed by output variable name
-            # initialize empty lists to track repetition outputs for each output variable
-            for output in self.output_getters:
-                job_outputs[output] = []
-            for i in range(self.job_repetitions):
-                self.simInitFunc()
-                while not self.simStopFunc():
-                    self.simStepFunc()
-                outputs = self.getOutputs()
-                for output in outputs:
-                    job_outputs[output].append(outputs[output])
-                self.outputFile.write("\n")
-                self.fileWriteOutputs(outputs)
-                
-            # write statistics to file
-            averages = collections.OrderedDict()
-            stddevs = collections.OrderedDict()
-            for variable in job_outputs:
-                averages[variable] = U.mean(job_outputs[variable])
-                stddevs[variable] = U.standardDeviation(job_outputs[variable])
-            self.output("\naverages: ")
-            self.fileWriteOutputs(averages)
-            self.output("\nstandard deviations: ")
-            self.fileWriteOutputs(stddevs)
+            key = tuple(job[setter] for setter in self.paramSetters if setter not in self.branch_setters)
+            groups.setdefault(key, []).append(job)
+        return list(groups.values())
+    
+    def applyParameters(self, job):
+        self.current_job = job
+        for setter in self.paramSetters:
+            setter(job[setter])
+    
+    def runPrefix(self, path):
+        self.simInitFunc()
+        steps = 0
+        while steps < self.branch_step and not self.simStopFunc():
+            self.simStepFunc()
+            steps += 1
+        self.simSaveFunc(path)
+    
+    def runBranch(self, path):
+        self.simLoadFunc(path)
+        if self.simBranchFunc is not None:
+            self.simBranchFunc()
+        while not self.simStopFunc():
+            self.simStepFunc()
         
+    def runRepetition(self):
+        path = self.checkpointPath()
+        if not (self.resume and self.simLoadFunc is not None and os.path.exists(path) and self.resumeFrom(path)):
+            self.simInitFunc()
+        steps = 0
+        while not self.simStopFunc():
+            self.simStepFunc()
+            steps += 1
+            if self.checkpoint_interval and steps % self.checkpoint_interval == 0:
+                self.simSaveFunc(path)
+        if self.checkpoint_interval:
+            self.simSaveFunc(path)  # so that resuming doesn't run a finished repetition again
+    
+    def resumeFrom(self, path):
+        """ Restores the checkpoint at path; False if it was saved under other settings, and is not resumed. """
+        self.simLoadFunc(path)
+        if self.simResumableFunc is None or self.simResumableFunc():
+            return True
+        self.output("\n%s was saved under other settings; repetition %d of job %d starts again"
+                    %(path, self.repetition, self.job_id))
+        return False
+    
+    def checkpointPath(self, prefix=False):
+        if (self.checkpoint_interval or prefix) and not os.path.isdir(self.checkpoint_directory):
+            os.makedirs(self.checkpoint_directory)
+        name = "%s job %d rep %d %s%s.npz"%(self.Name, self.job_id, self.repetition, self.parametersDigest(),
+                                            " prefix" if prefix else "")
+        return os.path.join(self.checkpoint_directory, name)
+    
+    def parametersDigest(self):
+        # of the defaults and the parameters of the current job, by setter name
+        parameters = [(setter.__name__, value) for setter, value in self.defaults.items()]
+        parameters += list(self.jobParameters(self.current_job).items())
+        return hashlib.sha1(json.dumps(parameters, default=repr).encode()).hexdigest()[:12]
+    
     def getOutputs(self):
         outputs = collections.OrderedDict()
         for getter_name in self.output_getters:
@@ -216,6 +516,11 @@ class Experiment(object):
             value = self.paramSetters[setter]
             message += str(value)
             self.output(message)
+        if self.branching():
+            self.output("\nParameters Taking Effect After Step %d (each group's first job sets them until then):"
+                        %self.branch_step)
+            for setter in self.branch_setters:
+                self.output("\n%40s"%setter.__name__)
         self.output("\n######################################################")
     
     def setDefaults(self):
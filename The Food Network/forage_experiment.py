@@ -4,6 +4,9 @@ import hhagent as HH
 import forager as F
 import datetime as DT
 import utility as U
+import streams as R
+import metrics as M
+import config as C
 import collections
 import experiment as exp
 
@@ -32,21 +35,87 @@ class ForageExperiment(exp.Experiment):
         print("Initializing landscape for job")
         self.metrics_start = 250
         self.landscape = None
+        self.landscape_seed = None  # None derives it from the root seed (see landscapeSeed)
+        self.root_seed = None  # the root seed of an unseeded experiment's runs (see rootSeed)
         self.sim_runtime = 1000
+        self.metrics_interval = 1  # sample the output metrics every this many steps after metrics_start
 
     def initiateSim(self):
-        if self.landscape==None:
-            self.landscape=L.Landscape()
-        self.theWorld = W.World(size=L.width, numagents= W.starting_agents, landscape=self.landscape)
+        # reloaded every run so that jobs sweeping the grid parameters get their own landscape
+        self.landscape = L.Landscape.load_or_generate(seed=self.landscapeSeed())
+        streams = R.RandomStreams(self.rootSeed(), self.job_id, self.repetition)
+        self.recorder = M.MetricsRecorder(steps=self.sim_runtime)
+        self.requestMetrics(self.recorder)
+        self.theWorld = W.World(size=L.width, numagents= W.starting_agents, landscape=self.landscape, streams=streams,
+                                recorder=self.recorder)
         self.time = 0
-        self.max_prestige = []
-        self.avg_prestige = []
+    
+    def requestMetrics(self, recorder):
+        # the series that World keeps with an entry for step 0 were always averaged from step
+        # metrics_start on, and the others from the step after it
+        start = self.metrics_start
+        for name in ['population', 'median_storage', 'food_shared']:
+            recorder.request(name, start, self.metrics_interval)
+        for name in ['max_hoover', 'avg_hoover', 'avg_food_stored', 'max_prestige', 'avg_prestige',
+                     'com_sharing', 'grn_sharing', 'brn_sharing']:
+            recorder.request(name, start + 1, self.metrics_interval)
+    
+    def samples(self, name):
+        return self.recorder.values(name).tolist()
+    
+    def saveSim(self, path):
+        self.theWorld.save_snapshot(path)
+    
+    def loadSim(self, path):
+        self.theWorld = W.World.load_snapshot(path)
+        self.recorder = self.theWorld.recorder
+        self.time = self.theWorld.time
+    
+    def resumable(self):
+        # a checkpoint saved under another configuration (another seed or engine, say) is not carried on
+        return self.theWorld.config == C.default()
+    
+    def branchable(self, setter, values):
+        # World.reconfigure only takes changes to the BRANCHABLE parameters of the configuration
+        changed = C.changedBy(setter, values)
+        return bool(changed) and changed <= C.BRANCHABLE
+    
+    def rootSeed(self):
+        # W.random_seed, or for an unseeded experiment a seed drawn once and shared by all of its runs
+        if W.random_seed is not None:
+            return W.random_seed
+        if self.root_seed is None:
+            self.root_seed = R.freshSeed()
+        return self.root_seed
+    
+    def landscapeSeed(self):
+        # the landscape a world seeded with the root seed generates, unless landscape_seed fixes one
+        if self.landscape_seed is not None:
+            return self.landscape_seed
+        return R.RandomStreams(self.rootSeed()).landscape.getrandbits(32)
+    
+    def simSettings(self, queued):
+        # an unseeded experiment run again from its queue keeps the root seed it was first queued with
+        if W.random_seed is None and queued is not None:
+            seed = queued["random_seed"]
+        else:
+            seed = self.rootSeed()
+        return {"random_seed": seed, "engine": W.simulation_engine}
+    
+    def applySimSettings(self, settings):
+        self.root_seed = settings["random_seed"]
+        W.setEngine(settings["engine"])
+    
+    def branchSim(self):
+        # carries the restored world on under the job's parameters
+        self.theWorld.reconfigure(C.default())
+    
+    def endSim(self):
+        self.theWorld.close()
     
     def stepSim(self):
         self.time += 1
         self.theWorld.step()
-        self.max_prestige.append(max(self.theWorld.hh_prestige))
-        self.avg_prestige.append(U.mean(self.theWorld.hh_prestige))
     
     def stopSim(self):
         if self.time>=self.sim_runtime:
@@ -67,6 +136,14 @@ class ForageExperiment(exp.Experiment):
         self.simInitFunc = self.initiateSim 
         self.simStepFunc = self.stepSim
         self.simStopFunc = self.stopSim 
+        self.simSaveFunc = self.saveSim
+        self.simLoadFunc = self.loadSim
+        self.simResumableFunc = self.resumable
+        self.simBranchFunc = self.branchSim
+        self.simBranchableFunc = self.branchable
+        self.simEndFunc = self.endSim
+        self.simSettingsFunc = self.simSettings
+        self.simApplySettingsFunc = self.applySimSettings
         
     """
     Override this method in subclasses, with the sections completed.
@@ -96,55 +173,55 @@ class ForageExperiment(exp.Experiment):
         self.job_repetitions = 2
         
     def avg_pop(self):
-        return U.mean(self.theWorld.populations[self.metrics_start:])
+        return U.mean(self.samples('population'))
     
     def hh_age(self):
         return self.theWorld.avg_hh_age[-1]
     
     def med_life(self):
-        return U.median(self.theWorld.ages_at_death)
+        return self.theWorld.ages_at_death.median()
     
     def avg_life(self):
-        return  U.mean(self.theWorld.ages_at_death)
+        return  self.theWorld.ages_at_death.mean()
     
     def adult_med_life(self):
-        return  U.median(self.theWorld.adult_ages_at_death)
+        return  self.theWorld.adult_ages_at_death.median()
     
     def adult_avg_life(self):
-        return  U.mean(self.theWorld.adult_ages_at_death)
+        return  self.theWorld.adult_ages_at_death.mean()
     
     def std_pop(self):
-        return  U.standardDeviation(self.theWorld.populations[self.metrics_start:])
+        return  U.standardDeviation(self.samples('population'))
     
     def max_run_prestige(self):
-        return max(self.max_prestige[self.metrics_start:])
+        return max(self.samples('max_prestige'))
     
     def avg_run_prestige(self):
-        return U.mean(self.avg_prestige[self.metrics_start:])
+        return U.mean(self.samples('avg_prestige'))
     
     def avg_median_stored(self):
-        return  U.mean(self.theWorld.median_storage[self.metrics_start:])
+        return  U.mean(self.samples('median_storage'))
     
     def avg_avg_hoover(self):
-        return  U.mean(self.theWorld.avg_hoover[self.metrics_start:])
+        return  U.mean(self.samples('avg_hoover'))
     
     def avg_max_hoover(self):
-        return  U.mean(self.theWorld.max_hoover[self.metrics_start:])
+        return  U.mean(self.samples('max_hoover'))
     
     def avg_stored(self):
-        return U.mean(self.theWorld.avg_food_stored[self.metrics_start:])
+        return U.mean(self.samples('avg_food_stored'))
         
     def avg_shared(self):
-        return  U.mean(self.theWorld.food_shared[self.metrics_start:])
+        return  U.mean(self.samples('food_shared'))
     
     def com_shared(self):
-        return  U.mean(self.theWorld.com_sharing[self.metrics_start:])
+        return  U.mean(self.samples('com_sharing'))
     
     def grn_shared(self):
-        return  U.mean(self.theWorld.grn_sharing[self.metrics_start:])
+        return  U.mean(self.samples('grn_sharing'))
     
     def brn_shared(self):
-        return  U.mean(self.theWorld.brn_sharing[self.metrics_start:])        
+        return  U.mean(self.samples('brn_sharing'))        
     
     def getTime(self):
         return self.time
@@ -5,10 +5,7 @@ ASSUMPTIONS:
 Foragers are monogamous
 """
 
-import random as rnd
-import hhagent as HH
-import utility as U
-import world as W
+import math
 
 """
 enums
@@ -50,6 +47,31 @@ def setSdvForagingExpertise(val = stddev_foraging_expertise):
 def homogeneous():
     return stddev_foraging_expertise==0
 
+# The original per-forager Ancestry trees only ever recorded parents (Ancestry.Generate never
+# filled in earlier generations), so kinship spans above 1 had no effect on kinship.  That is
+# kept as the default so results stay comparable; set True to trace the full kinship span.
+full_ancestry = False
+def setFullAncestry(val=full_ancestry):
+    global full_ancestry
+    full_ancestry = bool(val)
+    return full_ancestry
+
+def baseFoodNeed(age):
+    # the food a forager of age needs each step, before any shortfall carried over
+    if age < AGE_OF_ADULT:
+        return max([1/AGE_OF_ADULT, age/AGE_OF_ADULT])
+    else:
+        return 1.0
+
+def foragingExpertiseAt(innate, age):
+    # the expertise of a forager of age, which a juvenile grows into
+    if age < AGE_OF_JUVENILE :
+        return 0
+    elif age < AGE_OF_ADULT:
+        return innate*(age-AGE_OF_JUVENILE)/AGE_OF_JUVENILE
+    else:
+        return innate
+
 
 DEBUG=True
 
@@ -58,103 +80,52 @@ def debug(s):
         print(s)
 
 
-world = None
-        
-class Ancestry(object):
-    
-    def __init__(self, person, generations=2):
-        self.person = person #the actual person object represented by this node
-        self.ancestors = [None, None]
-        self.past_length = generations  # how far back the person tracks ancestors
-        parents = person.parents
-        if len(parents)==2:
-            self.ancestors[0] = [parents[0].ID, Ancestry.Generate(parents[0].ancestry.ancestors, generations-1)]
-            self.ancestors[1] = [parents[1].ID, Ancestry.Generate(parents[1].ancestry.ancestors, generations-1)]
-    
-    @staticmethod
-    def Generate(parent_ancestors, generations):
-        #recursively add parent ancestries until generation tracking variable equals 0
-        ancestors = [None, None]
-        if generations>0:
-            if ancestors[0] != None:
-                ancestors[0] = [parent_ancestors[0][0], Ancestry.Generate(parent_ancestors[0][1], generations-1)]
-            if ancestors[1] != None:
-                ancestors[1] = [parent_ancestors[1][0], Ancestry.Generate(parent_ancestors[1][1], generations-1)]
-        return ancestors
-    
-    def getAncestors(self, ancestors=None, generations=-1):
-        if generations==-1:
-            generations = self.past_length
-        if ancestors==None:
-            ancestors = self.ancestors
-        ancestor_set = set()
-        if generations<=0:
-            return ancestor_set
-        if ancestors[0] != None:
-            ancestor_set = ancestor_set.union(set([ancestors[0][0]]))
-            ancestor_set = ancestor_set.union(self.getAncestors(ancestors[0][1], generations-1))
-        if ancestors[1] != None:
-            ancestor_set = ancestor_set.union(set([ancestors[1][0]]))
-            ancestor_set = ancestor_set.union(self.getAncestors(ancestors[1][1], generations-1))
-        return ancestor_set
-              
-    def isKin(self, other):
-        my_ancestors = self.getAncestors() | set([self.person.ID])
-        their_ancestors = other.getAncestors() | set([other.person.ID])
-        return my_ancestors & their_ancestors
-
 class Forager(object):
     
-    next_ID = 0
-    death_count = 0
-    
-    @staticmethod
-    def reset():
-        Forager.next_ID = 0
-        Forager.death_count = 0
+    # no per-instance __dict__; every attribute a forager has is listed here
+    __slots__ = ('world', 'ID', 'household', 'lineage', 'mate', 'innate_foraging_expertise', 'kinship_span',
+                 'age', 'max_age', 'alive', 'food_need', 'amount_fed')
     
-    def __init__(self, age=0, parents=[], kinship_span=2):
-        self.ID = Forager.next_ID
-        Forager.next_ID += 1
+    def __init__(self, world, age=0, parents=[], kinship_span=2):
+        self.world = world
+        self.ID = world.nextForagerID()
         self.household = None
         self.lineage = None
         self.mate = None
-        self.innate_foraging_expertise = avg_foraging_expertise
+        self.innate_foraging_expertise = self.world.config.avg_foraging_expertise
         
         self.kinship_span = kinship_span
-        self.parents = parents
         for parent in parents:
             self.lineage = parent.household.lineage
             self.kinship_span = parent.kinship_span
-        self.ancestry = Ancestry(self, generations=self.kinship_span)
+        # only parent IDs are kept (in the world's pedigree), never the parents themselves
+        self.world.pedigree.add(self.ID, [parent.ID for parent in parents])
         
         if age==-1:
-            self.age = rnd.randrange(AGE_OF_ADULT,AGE_OF_SENIOR)
+            self.age = self.world.streams.demography.randrange(AGE_OF_ADULT,AGE_OF_SENIOR)
         else:
             self.age = age
         self.max_age = OLDEST
         self.alive = True
         self.food_need = self.getBaseFoodNeed()
         self.amount_fed = self.food_need
-        self.setExpertise()
+        self.setExpertise(parents)
         
     
-    def setExpertise(self):
-        avg = avg_foraging_expertise
-        stddev = stddev_foraging_expertise
+    def setExpertise(self, parents=[]):
+        avg = self.world.config.avg_foraging_expertise
+        stddev = self.world.config.stddev_foraging_expertise
         if stddev==0:
             exp = avg
         else:
             #clamp between 6-sigma extremes
             lb = -6*stddev
             ub = 6*stddev
-            # have to multiply by 10 first because small values break random.gauss()
-            birth_factor = U.randomBoundedNormal(0, stddev*10, lb*10, ub*10)
-            birth_factor = 1 + birth_factor/10 # recorrect by factor of 10
-            if len(self.parents) == 2:
-                w1 = rnd.random()*0.5 + 0.25
+            birth_factor = 1 + self.world.streams.demography.normals.draw(0, stddev, lb, ub)
+            if len(parents) == 2:
+                w1 = self.world.streams.demography.random()*0.5 + 0.25
                 w2 = 1 - w1
-                exp = w1*self.parents[0].foragingExpertise() + w2*self.parents[1].foragingExpertise()
+                exp = w1*parents[0].foragingExpertise() + w2*parents[1].foragingExpertise()
             else:
                 exp = avg
                 
@@ -167,13 +138,13 @@ class Forager(object):
                     
         self.innate_foraging_expertise = exp
     
-    def setKinshipSpan(self, kinship_span=2):
+    def setKinshipSpan(self, kinship_span=2, parents=[]):
         span = kinship_span
-        if len(self.parents) == 2:
-            if rnd.random() < 0.5:
-                span = self.parents[0].kinship_span
+        if len(parents) == 2:
+            if self.world.streams.demography.random() < 0.5:
+                span = parents[0].kinship_span
             else:
-                span = self.parents[1].kinship_span
+                span = parents[1].kinship_span
         
         self.kinship_span = span
     
@@ -182,7 +153,7 @@ class Forager(object):
         
         if not self.hasDied():
             if self.age==AGE_OF_ADULT:
-                world.spawnHouseholdFrom(self)
+                self.world.spawnHouseholdFrom(self)
             if self.isBachelor():
                 self.findAMate()
         
@@ -190,12 +161,7 @@ class Forager(object):
         self.amount_fed = 0
             
     def getBaseFoodNeed(self):
-        base_need = 0
-        if self.age < AGE_OF_ADULT:
-            base_need = max([1/AGE_OF_ADULT, self.age/AGE_OF_ADULT])
-        else:
-            base_need = 1.0
-        return base_need
+        return baseFoodNeed(self.age)
     
     def eat(self, amount):
         self.amount_fed += amount
@@ -240,36 +206,36 @@ class Forager(object):
             return False
              
     def findAMate(self):
-        neighbors = world.getNeighborhoodOf(self.household)
+        neighbors = self.world.getNeighborhoodOf(self.household)
         bachelors = []
         for neighbor in neighbors:
             bachelors.extend(neighbor.getBachelors())
-        rnd.shuffle(bachelors)
+        self.world.streams.demography.shuffle(bachelors)
         for bachelor in bachelors:
             if not self.findKinshipWith(bachelor):
                 self.marry(bachelor)
                 break
 
+    def ancestryDepth(self):
+        # how many generations back this forager tracks ancestors
+        depth = max(0, math.ceil(self.kinship_span))
+        if not self.world.config.full_ancestry:
+            depth = min(depth, 1)
+        return depth
+    
     def findKinshipWith(self, other):
-        return self.ancestry.isKin(other.ancestry)
+        return self.world.pedigree.areKin(self.ID, self.ancestryDepth(), other.ID, other.ancestryDepth())
     
     def traceAncestry(self):
-        return self.ancestry.getAncestors()
+        return self.world.pedigree.ancestors(self.ID, self.ancestryDepth())
     
     def hasDied(self):
         if self.age==self.max_age or self.getHealth() < 0:
-            Forager.death_count += 1
             self.alive = False    
         return not self.alive 
     
     def foragingExpertise(self):
-        expertise = self.innate_foraging_expertise
-        if self.age < AGE_OF_JUVENILE :
-            return 0
-        elif self.age < AGE_OF_ADULT:
-            return expertise*(self.age-AGE_OF_JUVENILE)/AGE_OF_JUVENILE
-        else:
-            return expertise
+        return foragingExpertiseAt(self.innate_foraging_expertise, self.age)
     
     def isAdult(self):
         return self.age >= AGE_OF_ADULT
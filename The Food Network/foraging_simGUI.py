@@ -58,7 +58,7 @@ def draw(figure):
     
     cmap.set_under()
     PL.pcolormesh(theWorld.foraging_resources, cmap = cmap, vmin=0,
-                  vmax=W.max_resource)
+                  vmax=theWorld.config.max_resource)
     PL.axis('scaled')
     PL.hold(True)
     xyp = zip(*[theWorld.hh_locations[hh] for hh in theWorld.households])
@@ -69,7 +69,7 @@ def draw(figure):
         y = [i+0.5 for i in xy[1]]
         lineage = [hh.lineage for hh in (theWorld.households)]
         hh_size = [20*hh.size() for hh in (theWorld.households)]
-        PL.scatter(y, x, c = lineage, s=hh_size, vmin=0, vmax=W.starting_agents, cmap = plt.get_cmap('hsv'))
+        PL.scatter(y, x, c = lineage, s=hh_size, vmin=0, vmax=theWorld.config.starting_agents, cmap = plt.get_cmap('hsv'))
         message = r't = {0}     Pop.: {1}     HHs: {2}    max HHs: {3}'
         PL.title(message.format(time, theWorld.population, len(theWorld.households), max(lineage))) 
     PL.hold(False)
@@ -1,8 +1,6 @@
 import forager as F
-import random as rnd
 import utility as U
 import landscape as L
-import world as W
 
 
 DEBUG=True
@@ -51,23 +49,20 @@ def setBRNHelp(val=brn_help):
     brn_help = bool(val)
     return val
 
-world = None
-
-
+def moveCost(config, size, distance):
+    # what a household of size members pays to move distance; staying put costs a move of 0
+    return size*(1+distance)*config.fractional_move_cost
 
 class HHAgent(object):
     
-    nextID=0
-    first=None # a debug variable
-    
-    @staticmethod
-    def reset():
-        HHAgent.nextID=0
-        HHAgent.first=None   
+    # no per-instance __dict__; every attribute a household has is listed here
+    __slots__ = ('world', 'ID', 'lineage', 'food_storage', 'food_needs', 'age', 'parents', 'children',
+                 'adoptees', 'nextBaby', 'kin_set', 'member_list', 'food_required', 'hungry',
+                 'foraging_ability')
     
-    def __init__(self, lineage=None):
-        self.ID = HHAgent.nextID
-        HHAgent.nextID +=1
+    def __init__(self, world, lineage=None):
+        self.world = world
+        self.ID = world.nextHouseholdID()
         
         if lineage==None:
             self.lineage = self.ID
@@ -75,23 +70,33 @@ class HHAgent(object):
             self.lineage = lineage
             
         self.food_storage = 0
+        self.food_needs = 0
         self.age = 0
-        self.commitments = {} # commitments to other households
         self.parents = []
         self.children = []
         self.adoptees = []  #extended family?
         self.nextBaby = None
+        self.kin_set = None  # cached union of the members' ancestries; None until needed
+        # running aggregates over the members, refreshed by updateAggregates() whenever members
+        # eat, move, age, join or leave, so that the queries below don't walk the members
+        self.member_list = ()
+        self.food_required = 0
+        self.hungry = False
+        self.foraging_ability = 0
         
     def adopt(self, forager):
         self.adoptees.append(forager)
+        self.updateMembers()
         forager.joinHousehold(self)
     
     def addParent(self, parent):
         self.parents.append(parent)
+        self.updateMembers()
         parent.joinHousehold(self)
         
     def addChild(self, child):
         self.children.append(child)
+        self.updateMembers()
         child.joinHousehold(self)
     
     def removeMember(self, member):
@@ -101,12 +106,32 @@ class HHAgent(object):
             self.children.remove(member)
         elif self.adoptees.count(member) > 0:
             self.adoptees.remove(member)
+        self.updateMembers()
+    
+    def updateMembers(self):
+        self.invalidateKinSet()
+        self.member_list = tuple(self.parents + self.children + self.adoptees)
+        self.updateAggregates()
+    
+    def updateAggregates(self):
+        needs = 0
+        hungry = False
+        ability = 0
+        for member in self.member_list:
+            needs += member.foodRequired()
+            hungry = hungry or member.getHealth()<1.0
+            if member is not None:
+                ability += member.foragingExpertise()
+        self.food_required = needs
+        self.hungry = hungry
+        self.foraging_ability = ability
     
     def combineWith(self, other):
-        for child in other.children:
+        self.invalidateKinSet()
+        for child in list(other.children):  # addChild takes each child out of other.children
             self.addChild(child)
         self.food_storage += other.food_storage
-        world.removeHousehold(other)
+        self.world.removeHousehold(other)
     
     def step(self):
         self.age += 1
@@ -124,22 +149,23 @@ class HHAgent(object):
             self.dispositionExcess()
             self.makeABaby()
             
-            for member in self.members():
+            members = self.members()
+            for member in members:
                 member.step()
+            # members that moved out to a new household aged after joining it
+            for hh in set([member.household for member in members]):
+                hh.updateAggregates()
         else:
             pass
         if self.food_storage <0:  #this is needed to eliminate floating point errors that are messing up the Hoover index
             self.food_storage = 0
                     
     def determineFoodNeeds(self):
-        needs = 0
-        for member in self.members():
-            needs += member.foodRequired()
-        return needs
+        return self.food_required
     
     
     def forage(self):
-        gathering = world.forageResources(self, self.foragingAbility())
+        gathering = self.world.forageResources(self, self.foragingAbility())
         self.food_storage += gathering
     
     def eat(self):
@@ -150,17 +176,17 @@ class HHAgent(object):
                 amount = fraction*member.foodRequired()
                 member.eat(amount)
                 self.food_storage -= amount
+            if self.food_storage < 0:  # rounding residue of eating it all, which would be shared as negative amounts
+                self.food_storage = 0
+            self.updateAggregates()
     
     def isStarving(self):
-        cost_to_forage = subsistence_threshold*self.costToMoveDelta((1,1))
-        food_amount = (self.food_storage + world.resourcesAt(world.locationOf(self)))
+        cost_to_forage = self.world.config.subsistence_threshold*self.costToMoveDelta((1,1))
+        food_amount = (self.food_storage + self.world.resourcesAt(self.world.locationOf(self)))
         return self.isHungry() and food_amount < self.determineFoodNeeds() + cost_to_forage
     
     def isHungry(self):
-        hungry = False
-        for m in self.members():
-            hungry = hungry or m.getHealth()<1.0
-        return hungry
+        return self.hungry
     
     def getBachelors(self):
         bachelors = []
@@ -173,8 +199,8 @@ class HHAgent(object):
         if self.nextBaby != None :
             self.addChild(self.nextBaby)
             self.nextBaby = None
-        if self.canMakeABaby() and rnd.random() < birth_rate:
-            self.nextBaby = F.Forager(age=0, parents=self.parents)
+        if self.canMakeABaby() and self.world.streams.demography.random() < self.world.config.birth_rate:
+            self.nextBaby = self.world.newForager(age=0, parents=self.parents)
     
     def canMakeABaby(self):
         if len(self.parents)==2:
@@ -183,15 +209,14 @@ class HHAgent(object):
             return False
         
     def askNeighborsForHelp(self):
-        neighborhood = world.getNeighborhoodOf(self, radius=NEIGHBORHOOD_RADIUS)
+        neighborhood = self.world.getNeighborhoodOf(self, radius=NEIGHBORHOOD_RADIUS)
         if len(neighborhood)==0:
             self.moveToRandomLocation()
             self.forage()
             self.eat()
-        elif grn_help or brn_help:
-            if grn_help:
-                kin_neighbors = [hh for hh in neighborhood if self.kinshipWith(hh)]
-                total_kin_storage = sum([hh.food_storage for hh in kin_neighbors])
+        elif self.world.config.grn_help or self.world.config.brn_help:
+            kin_neighbors, nonkin_neighbors, total_kin_storage = self.world.partitionKin(self, neighborhood)
+            if self.world.config.grn_help:
                 food_deficit = self.determineFoodNeeds() - self.food_storage
                 if total_kin_storage > 0 and food_deficit > 0:
                     for kin_hh in kin_neighbors:
@@ -199,8 +224,7 @@ class HHAgent(object):
                         amount = food_deficit*kin_hh.food_storage/total_kin_storage
                         kin_hh.requestFoodFor(self, amount)
                         self.eat()
-            if brn_help and self.isStarving():
-                nonkin_neighbors = [hh for hh in neighborhood if not self.kinshipWith(hh)]
+            if self.world.config.brn_help and self.isStarving():
                 nonkin_neighbors = sorted(nonkin_neighbors, key=lambda neighbor: neighbor.debtTo(self))
                 for neighbor in nonkin_neighbors:
                     food_deficit = self.determineFoodNeeds() - self.food_storage
@@ -220,22 +244,17 @@ class HHAgent(object):
         self.food_storage -= amount
         if other!=self:  # can't have debts to one's self
             other.increaseCommitments(self, amount)
-            world.reportFoodSharing(amount)
+            self.world.reportFoodSharing(amount)
         return amount
         
     def increaseCommitments(self, other, amount):
-        if (self.kinshipWith(other) and grn_help):  #GRN does not track commitment
-            world.reportGRNSharing(amount)
-        elif brn_help:
-            if self not in other.commitments:
-                other.commitments[self] = 0
-            if other not in self.commitments:
-                self.commitments[other] = 0
-            self.commitments[other] += amount
-            other.commitments[self] -= amount
-            world.reportBRNSharing(amount)
-        elif communal_sharing:
-            world.reportCOMSharing(amount)
+        if (self.kinshipWith(other) and self.world.config.grn_help):  #GRN does not track commitment
+            self.world.reportGRNSharing(amount)
+        elif self.world.config.brn_help:
+            self.world.ledger.record(self.ID, other.ID, amount)
+            self.world.reportBRNSharing(amount)
+        elif self.world.config.communal_sharing:
+            self.world.reportCOMSharing(amount)
             
 
     def dispositionExcess(self):
@@ -243,22 +262,22 @@ class HHAgent(object):
         # additional BRN sharing in this activity was only occurring *if*
         # communal_sharing was turned on.  This is logically inconsistent, since
         # BRN sharing is intended to be independent from communal sharing.
-        neighborhood = world.getNeighborhoodOf(self, radius=1)#NEIGHBORHOOD_RADIUS)
+        neighborhood = self.world.getNeighborhoodOf(self, radius=1)#NEIGHBORHOOD_RADIUS)
         food_shared = self.food_storage - self.amountToSetAside()
         if neighborhood:
             # separate into debtors and everyone else
             neighborhood = sorted(neighborhood, key = lambda hh: hh.debtTo(self))
-            if brn_help:
+            if self.world.config.brn_help:
                 debtees = [hh for hh in neighborhood if self.debtTo(hh)>0]            
                 #pay back debts owed first
                 for debtee in debtees:
                     if food_shared <= 0:
                         break
                     else :
-                        amount = self.giveFoodTo(debtee, self.commitments[debtee])
+                        amount = self.giveFoodTo(debtee, self.debtTo(debtee))
                         food_shared -= amount
             #finally, share what's left, communally or with kin
-            if communal_sharing:
+            if self.world.config.communal_sharing:
                 everyone_else = [hh for hh in neighborhood if hh.debtTo(self)>=0]
                 everyone_else.append(self)  # we get to participate in the feast
                 count = sum([hh.size() for hh in everyone_else])
@@ -266,8 +285,8 @@ class HHAgent(object):
                     portion = food_shared/count
                     for neighbor in everyone_else:
                         self.giveFoodTo(neighbor, portion*neighbor.size())
-            elif grn_help:
-                kin = [hh for hh in neighborhood if self.kinshipWith(hh)]
+            elif self.world.config.grn_help:
+                kin, nonkin, kin_storage = self.world.partitionKin(self, neighborhood)
                 kin.append(self)
                 count = sum([hh.size() for hh in kin])
                 if food_shared>0 and count:
@@ -299,31 +318,18 @@ class HHAgent(object):
 #                         self.giveFoodTo(neighbor, portion*neighbor.size())
     
     def debtTo(self, other):
-        if other in self.commitments:
-            return self.commitments[other]
-        else:
-            return 0
+        return self.world.ledger.debt(self.ID, other.ID)
     
     def prestige(self):
-        sum = 0
-        for hh in self.commitments.keys():
-            sum -= self.commitments[hh]
-        return sum
+        return self.world.ledger.prestigeOf(self.ID)
     
     def localPrestige(self):
-        neighborhood = world.getNeighborhoodOf(self, radius=1)
-        prestige = 0
-        for neighbor in neighborhood:
-            if neighbor in self.commitments:
-                prestige += neighbor.commitments[self]
-        return prestige
+        neighborhood = self.world.getNeighborhoodOf(self, radius=1)
+        return self.world.ledger.creditFrom(self.ID, neighborhood)
     
     def amountToSetAside(self):
-        neighborhood = world.getNeighborhoodOf(self, radius=1)
-        storage = 0
-        for neighbor in neighborhood:
-            if self in neighbor.commitments:
-                storage += neighbor.commitments[self]
+        neighborhood = self.world.getNeighborhoodOf(self, radius=1)
+        storage = self.world.ledger.creditFrom(self.ID, neighborhood)
         storage = min([storage, self.food_storage])
         
         return storage
@@ -332,21 +338,27 @@ class HHAgent(object):
         return filter(lambda m: m.isAdult(), self.members())
     
     def members(self):
-        members = []
-        members.extend(self.parents)
-        members.extend(self.children)
-        members.extend(self.adoptees)
-        
-        return members
+        # parents, then children, then adoptees; an immutable snapshot, so no copy is needed
+        # to iterate it while members join or leave
+        return self.member_list
+    
+    def kinSet(self):
+        # ancestries are fixed at birth, so the union only changes when membership does
+        if self.kin_set is None:
+            kin_set = set()
+            for member in self.members():
+                kin_set |= member.traceAncestry()
+            self.kin_set = kin_set
+            self.world.indexKin(self, kin_set)
+        return self.kin_set
+    
+    def invalidateKinSet(self):
+        if self.kin_set is not None:
+            self.world.unindexKin(self, self.kin_set)
+            self.kin_set = None
     
     def kinshipWith(self, other):
-        my_kin_set = set()
-        for member in self.members():
-            my_kin_set = my_kin_set | member.traceAncestry()
-        their_kin_set = set()
-        for member in other.members():
-            their_kin_set = their_kin_set | member.traceAncestry()
-        return my_kin_set & their_kin_set
+        return self.kinSet() & other.kinSet()
     
     
     
@@ -355,35 +367,32 @@ class HHAgent(object):
         for member in self.members():
             if member.hasDied():
                 deadlist.append(member)
-                world.reportADeath(member)
+                self.world.reportADeath(member)
         for dead in deadlist:
             if dead.mate != None:
                 dead.mate.mate = None
             self.removeMember(dead)
+            self.world.pool.release(dead)
         return self.size()==0
             
     def size(self):
-        return len(self.parents) + len(self.children) + len(self.adoptees)
+        return len(self.member_list)
     
     def foragingAbility(self):
-        ability = 0
-        for forager in self.members():
-            if forager is not None:
-                ability += forager.foragingExpertise()
-        return ability
+        return self.foraging_ability
     
     def traverseTo(self, goal_location):
         goal_reached = False
         gx, gy = goal_location
         while not self.isStarving() and not goal_reached:
-            lx, ly = world.locationOf(self)
+            lx, ly = self.world.locationOf(self)
             dx = gx - lx
             if dx!=0:
                 dx = round(dx/abs(dx))
             dy = gy - ly
             if dy != 0:
                 dy = round(dy/abs(dy))
-            location = W.addlocs((lx,ly),(dx,dy))
+            location = self.world.spatial.wrap((lx,ly),(dx,dy))
 #             location, resources = world.bestLocationAt(location)
             self.moveTo(location)
             self.forage()
@@ -392,57 +401,56 @@ class HHAgent(object):
                 goal_reached = True
     
     def costOfMoveBetween(self, old_location, new_location):
-        return self.size()*(1+L.distanceBetween(old_location, new_location))*fractional_move_cost
+        return moveCost(self.world.config, self.size(), self.world.spatial.distanceBetween(old_location, new_location))
     
     def costToMoveDelta(self, deltaXY):
-        return self.size()*(1+L.distanceBetween((0,0), deltaXY))*fractional_move_cost 
+        return moveCost(self.world.config, self.size(), self.world.spatial.distanceBetween((0,0), deltaXY))
     
     def moveTo(self, new_location):
-        current_loc = world.locationOf(self)
+        current_loc = self.world.locationOf(self)
         cost = self.costOfMoveBetween(current_loc, new_location)
         if current_loc!=new_location:
-            world.moveHouseholdTo(self, new_location)
+            self.world.moveHouseholdTo(self, new_location)
             self.dispositionExcess()
             self.food_storage = 0
         ind_cost = cost/self.size()
         for member in self.members():
-            member.move(ind_cost)      
+            member.move(ind_cost)
+        self.updateAggregates()
         
     def moveToAnotherLocation(self):
-        location, resources = world.bestLocationAt(world.locationOf(self)) 
+        location, resources = self.world.bestLocationAt(self.world.locationOf(self)) 
         self.moveTo(location)
         
     def moveToRandomLocation(self):
-        location = (rnd.randrange(L.width),rnd.randrange(L.width))
+        location = (self.world.streams.movement.randrange(self.world.config.width),self.world.streams.movement.randrange(self.world.config.width))
         self.moveTo(location)
         
     def moveRandomDelta(self):
-        d_loc = (rnd.randrange(3)-1,rnd.randrange(3)-1)
-        location = world.locationOf(self)
-        self.moveTo(W.addlocs(location, d_loc))
+        d_loc = (self.world.streams.movement.randrange(3)-1,self.world.streams.movement.randrange(3)-1)
+        location = self.world.locationOf(self)
+        self.moveTo(self.world.spatial.wrap(location, d_loc))
         
     def evaluateLocationAgainst(self, alternate_location):
-        current_location = world.locationOf(self)
+        current_location = self.world.locationOf(self)
         cost_to_relocate = self.costOfMoveBetween(current_location, alternate_location)
         cost_to_stay = self.costOfMoveBetween(current_location, current_location)
-        resources_here = world.resourcesAt(current_location)
-        resources_there = world.resourcesAt(alternate_location)
-        if grn_help:  #cognition about accounting for kin in where to move added 12/1
-            neighborhood = world.getNeighborsAround(current_location, radius=1)
-            kin_neighbors = [hh for hh in neighborhood if self.kinshipWith(hh)]
-            total_kin_storage = sum([hh.food_storage for hh in kin_neighbors])
+        resources_here = self.world.resourcesAt(current_location)
+        resources_there = self.world.resourcesAt(alternate_location)
+        if self.world.config.grn_help:  #cognition about accounting for kin in where to move added 12/1
+            neighborhood = self.world.getNeighborsAround(current_location, radius=1)
+            kin_neighbors, nonkin_neighbors, total_kin_storage = self.world.partitionKin(self, neighborhood)
             resources_here += total_kin_storage
-            neighborhood = world.getNeighborsAround(alternate_location, radius=1)
-            kin_neighbors = [hh for hh in neighborhood if self.kinshipWith(hh)]
-            total_kin_storage = sum([hh.food_storage for hh in kin_neighbors])
+            neighborhood = self.world.getNeighborsAround(alternate_location, radius=1)
+            kin_neighbors, nonkin_neighbors, total_kin_storage = self.world.partitionKin(self, neighborhood)
             resources_there += total_kin_storage - self.food_storage
             
         return (resources_there - cost_to_relocate) - (resources_here - cost_to_stay)
     
     def evaluateAndMove(self):
-        current = world.locationOf(self)
+        current = self.world.locationOf(self)
         new_location = current
-        best_resource_location, best_resources = world.bestLocationAt(world.locationOf(self))
+        best_resource_location, best_resources = self.world.bestLocationAt(self.world.locationOf(self))
         if best_resource_location!=current:
             if self.evaluateLocationAgainst(best_resource_location) > 0:
                 new_location = best_resource_location
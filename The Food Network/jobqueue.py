@@ -0,0 +1,193 @@
+""" jobqueue.py
+A queue of experiment tasks in a SQLite file, for spreading an experiment over
+several processes or machines that share a filesystem.
+
+The process that runs the experiment (Experiment.run, with queue_path set)
+submits one task per repetition of each job of its full factorial design (per
+repetition of each group of jobs sharing a prefix, when branching), works on
+them itself, and writes the results once every task is done.  Any number of
+workers started with Experiment.work, or from the command line:
+
+    python jobqueue.py QUEUE MODULE CLASS
+
+take tasks from the same queue until none are left.  A worker holds a lease on
+each task it takes, and renews it while the task runs; the lease of a worker
+that crashes or is killed expires, and the task is then given to another worker.
+Results are written in the same transaction that marks a task done, so a task
+is either done, with its outputs, or not done at all.
+
+Every change is made in an immediate transaction, which SQLite serializes with
+file locks, so the filesystem must support them (local disks and most network
+filesystems do).  No server is needed.
+"""
+
+import contextlib
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+LEASE_TIME = 120  # seconds a task stays leased without a renewal
+MAX_ATTEMPTS = 3  # leases of a task that may expire before the task is failed
+
+PENDING = 'pending'
+LEASED = 'leased'
+DONE = 'done'
+FAILED = 'failed'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    experiment TEXT NOT NULL,
+    task INTEGER NOT NULL,
+    spec TEXT NOT NULL,
+    state TEXT NOT NULL,
+    worker TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    outputs TEXT,
+    PRIMARY KEY (experiment, task)
+)
+"""
+
+def plain(value):
+    # NumPy scalars, which experiment outputs often are, as the Python numbers JSON can hold
+    return value.item()
+
+class JobQueue(object):
+
+    def __init__(self, path, lease_time=LEASE_TIME, max_attempts=MAX_ATTEMPTS, worker=None):
+        self.path = path
+        self.lease_time = lease_time
+        self.max_attempts = max_attempts
+        if worker is None:
+            worker = "%s:%d"%(socket.gethostname(), os.getpid())
+        self.worker = worker
+        with self.transaction() as db:
+            db.execute(SCHEMA)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        db = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        try:
+            db.execute("BEGIN IMMEDIATE")  # takes the write lock at once, so reads and updates are atomic
+            try:
+                yield db
+            except:
+                db.execute("ROLLBACK")
+                raise
+            db.execute("COMMIT")
+        finally:
+            db.close()
+
+    def submit(self, experiment, specs):
+        """
+        Adds a task for each spec (a JSON-compatible description of the task), numbered in order.
+        Tasks already in the queue are kept, with their results if they are done, so submitting
+        an experiment again resumes it; they must have the same specs.  Failed tasks are pending
+        again, with all of their attempts, so that the rerun retries them.
+        """
+        specs = [json.dumps(spec, sort_keys=True) for spec in specs]
+        with self.transaction() as db:
+            for task, spec in enumerate(specs):
+                db.execute("INSERT OR IGNORE INTO tasks (experiment, task, spec, state) VALUES (?, ?, ?, ?)",
+                           (experiment, task, spec, PENDING))
+            queued = db.execute("SELECT spec FROM tasks WHERE experiment = ? ORDER BY task", (experiment,)).fetchall()
+            if [row[0] for row in queued] != specs:
+                raise ValueError("the queue in %s holds a different design or settings for experiment %r"
+                                 %(self.path, experiment))
+            db.execute("UPDATE tasks SET state = ?, worker = NULL, lease_expires = NULL, attempts = 0, outputs = NULL "
+                       "WHERE experiment = ? AND state = ?", (PENDING, experiment, FAILED))
+
+    def spec(self, experiment, task):
+        """ The spec task was submitted with, or None if the experiment has no such task. """
+        with self.transaction() as db:
+            row = db.execute("SELECT spec FROM tasks WHERE experiment = ? AND task = ?", (experiment, task)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def lease(self, experiment):
+        """ Leases the first task that is pending or whose lease has expired; returns (task, spec), or None. """
+        now = time.time()
+        with self.transaction() as db:
+            # expired leases that have had all their attempts fail the task, rather than retrying it forever
+            db.execute("UPDATE tasks SET state = ?, outputs = ? WHERE experiment = ? AND state = ? AND lease_expires < ? "
+                       "AND attempts >= ?", (FAILED, json.dumps("lease expired %d times"%(self.max_attempts,)),
+                                             experiment, LEASED, now, self.max_attempts))
+            row = db.execute("SELECT task, spec FROM tasks WHERE experiment = ? AND (state = ? OR (state = ? AND "
+                             "lease_expires < ?)) ORDER BY task LIMIT 1", (experiment, PENDING, LEASED, now)).fetchone()
+            if row is None:
+                return None
+            db.execute("UPDATE tasks SET state = ?, worker = ?, lease_expires = ?, attempts = attempts + 1 "
+                       "WHERE experiment = ? AND task = ?", (LEASED, self.worker, now + self.lease_time, experiment, row[0]))
+        return row[0], json.loads(row[1])
+
+    def renew(self, experiment, task):
+        with self.transaction() as db:
+            db.execute("UPDATE tasks SET lease_expires = ? WHERE experiment = ? AND task = ? AND state = ? AND worker = ?",
+                       (time.time() + self.lease_time, experiment, task, LEASED, self.worker))
+
+    @contextlib.contextmanager
+    def holding(self, experiment, task):
+        """ Renews the lease on task every third of the lease time, for as long as the block runs. """
+        stop = threading.Event()
+        def renewals():
+            while not stop.wait(self.lease_time/3):
+                self.renew(experiment, task)
+        renewer = threading.Thread(target=renewals)
+        renewer.daemon = True
+        renewer.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            renewer.join()
+
+    def complete(self, experiment, task, outputs):
+        # a worker whose lease expired may finish after another worker; the first result is kept
+        with self.transaction() as db:
+            db.execute("UPDATE tasks SET state = ?, outputs = ?, worker = ? WHERE experiment = ? AND task = ? AND state != ?",
+                       (DONE, json.dumps(outputs, default=plain), self.worker, experiment, task, DONE))
+
+    def fail(self, experiment, task, message):
+        with self.transaction() as db:
+            db.execute("UPDATE tasks SET state = ?, outputs = ? WHERE experiment = ? AND task = ? AND state != ?",
+                       (FAILED, json.dumps(message), experiment, task, DONE))
+
+    def counts(self, experiment):
+        """ The number of tasks of the experiment in each state. """
+        counts = dict((state, 0) for state in (PENDING, LEASED, DONE, FAILED))
+        with self.transaction() as db:
+            for state, count in db.execute("SELECT state, COUNT(*) FROM tasks WHERE experiment = ? GROUP BY state",
+                                           (experiment,)):
+                counts[state] = count
+        return counts
+
+    def failures(self, experiment):
+        with self.transaction() as db:
+            return [(task, json.loads(message)) for task, message in
+                    db.execute("SELECT task, outputs FROM tasks WHERE experiment = ? AND state = ? ORDER BY task",
+                               (experiment, FAILED))]
+
+    def results(self, experiment):
+        """ The outputs of every task of the experiment, in task order, once all of them are done. """
+        with self.transaction() as db:
+            rows = db.execute("SELECT state, outputs FROM tasks WHERE experiment = ? ORDER BY task",
+                              (experiment,)).fetchall()
+        if any(state != DONE for state, outputs in rows):
+            raise ValueError("experiment %r has tasks that are not done"%(experiment,))
+        return [json.loads(outputs) for state, outputs in rows]
+
+"""
+MAIN
+"""
+if __name__ == '__main__':
+    import importlib
+    import sys
+    if len(sys.argv) != 4:
+        print("usage: python jobqueue.py QUEUE MODULE CLASS")
+        sys.exit(2)
+    queue_path, module_name, class_name = sys.argv[1:]
+    experiment = getattr(importlib.import_module(module_name), class_name)()
+    experiment.queue_path = queue_path
+    experiment.work()
@@ -1,12 +1,9 @@
-import matplotlib
-matplotlib.use('TkAgg')
-
-import pylab as PL
 import random as RD
-import scipy as SP
+import numpy as NP
+import hashlib
+import struct
 import math
-
-RD.seed()
+import os
 
 width = 50
 loci_weight = 10
@@ -23,10 +20,98 @@ cmin = 0.1
 pct_loci = 0.01
 cont = True
 
+# whole-array landscape generation; set False to use the original cell-by-cell loop
+vectorized = True
+def setVectorized(val=vectorized):
+    global vectorized
+    vectorized = bool(val)
+    return vectorized
+
+# generated landscapes are cached on disk here, keyed by their generation parameters
+cache_dir = "landscape_cache"
+def setCacheDir(val=cache_dir):
+    global cache_dir
+    cache_dir = str(val)
+    return cache_dir
+
+CACHE_MAGIC = b'LSC1'
+CACHE_VERSION = 1
+CACHE_HEADER = struct.Struct('<4sII')  # magic, version, number of loci
+loaded = {}  # landscapes already loaded by this process, by cache key
+
 class Landscape(object):
     
-    def __init__(self):
-        self.values = SP.zeros([width, width])
+    @staticmethod
+    def cacheKey(seed):
+        key = repr((width, float(grid_length), float(loci_weight), float(cmin), seed, vectorized))
+        return hashlib.sha1(key.encode()).hexdigest()
+    
+    @staticmethod
+    def load_or_generate(seed=0, directory=None):
+        """
+        Returns the landscape generated from the current module parameters and the given seed.
+        The landscape is read (memory-mapped) from the on-disk cache if an earlier run or
+        another worker already generated it; otherwise it is generated and written there.
+        With seed=None a fresh random landscape is generated and nothing is cached.
+        """
+        if seed is None:
+            return Landscape()
+        if directory is None:
+            directory = cache_dir
+        key = Landscape.cacheKey(seed)
+        if key in loaded:
+            return loaded[key]
+        path = os.path.join(directory, "landscape-%s.bin"%key)
+        try:
+            landscape = Landscape.readCacheFile(path)
+        except (IOError, ValueError):
+            landscape = Landscape(seed)
+            landscape.writeCacheFile(path)
+        loaded[key] = landscape
+        return landscape
+    
+    @staticmethod
+    def readCacheFile(path):
+        with open(path, 'rb') as f:
+            header = f.read(CACHE_HEADER.size)
+        if len(header) < CACHE_HEADER.size:
+            raise ValueError("truncated landscape cache file: %s"%path)
+        magic, version, n_loci = CACHE_HEADER.unpack(header)
+        if magic != CACHE_MAGIC or version != CACHE_VERSION:
+            raise ValueError("not a landscape cache file: %s"%path)
+        # the values, then each locus as two int32 and its value
+        if os.path.getsize(path) != CACHE_HEADER.size + width*width*8 + n_loci*(2*4 + 8):
+            raise ValueError("truncated landscape cache file: %s"%path)
+        offset = CACHE_HEADER.size
+        values = NP.memmap(path, dtype='<f8', mode='r', offset=offset, shape=(width, width))
+        offset += values.nbytes
+        loci = NP.memmap(path, dtype='<i4', mode='r', offset=offset, shape=(n_loci, 2)) if n_loci else NP.zeros((0, 2))
+        offset += loci.nbytes
+        loci_values = NP.memmap(path, dtype='<f8', mode='r', offset=offset, shape=(n_loci,)) if n_loci else []
+        
+        landscape = Landscape.__new__(Landscape)
+        landscape.values = values
+        landscape.loci = [(int(x), int(y)) for x, y in loci]
+        landscape.loci_values = dict(zip(landscape.loci, [float(c) for c in loci_values]))
+        return landscape
+    
+    def writeCacheFile(self, path):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        # write to a private file first so that parallel workers never read a partial landscape
+        tmp_path = "%s.%d.tmp"%(path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            f.write(CACHE_HEADER.pack(CACHE_MAGIC, CACHE_VERSION, len(self.loci)))
+            f.write(NP.ascontiguousarray(self.values, dtype='<f8').tobytes())
+            f.write(NP.array(self.loci, dtype='<i4').reshape(-1, 2).tobytes())
+            f.write(NP.array([self.loci_values[locus] for locus in self.loci], dtype='<f8').tobytes())
+        os.replace(tmp_path, path)
+    
+    def __init__(self, seed=None):
+        self.random = RD.Random(seed)
+        self.np_random = NP.random.default_rng(seed)
+        self.values = NP.zeros([width, width])
         self.loci = []
         self.loci_values = dict()
         
@@ -54,18 +139,62 @@ class Landscape(object):
             else:
                 loci_number = -int(grid_length)
             for i in range(loci_number):
-                y = RD.randrange(width)
-                x = RD.randrange(width)
-                c = RD.random()*(1-cmin)+cmin
+                y = self.random.randrange(width)
+                x = self.random.randrange(width)
+                c = self.random.random()*(1-cmin)+cmin
                 self.values[x,y] = c
                 locus = (x,y)
                 self.loci.append(locus)
                 self.loci_values[locus] = c
             self.generateWithLoci()
         else:
-            self.values = SP.ones([width, width])
+            self.values = NP.ones([width, width])
         
     def generateWithLoci(self):
+        if vectorized:
+            self.generateWithLociVectorized()
+        else:
+            self.generateWithLociIterative()
+    
+    def generateWithLociVectorized(self):
+        # same diffusion as generateWithLociIterative, but each pass is done on whole arrays:
+        # every positive cell picks a random cell in its 3x3 neighborhood, and every picked
+        # non-locus cell gets the weighted average of its non-locus neighbors and the loci.
+        is_locus = NP.zeros([width, width], dtype=bool)
+        locus_sum = NP.zeros([width, width])  # sum of locus value * inverse-square weight
+        locus_weights = NP.zeros([width, width])
+        coords = NP.arange(width)
+        for locus in self.loci:
+            lx, ly = locus
+            is_locus[lx, ly] = True
+            dx = NP.abs(coords - lx)
+            dx = NP.minimum(dx, width - dx)  # toroidal distances
+            dy = NP.abs(coords - ly)
+            dy = NP.minimum(dy, width - dy)
+            d_squared = (dx[:, NP.newaxis]**2 + dy[NP.newaxis, :]**2).astype(float)
+            d_squared[lx, ly] = NP.inf  # loci are never updated, so their own weight is unused
+            weight = loci_weight/d_squared
+            locus_sum += self.loci_values[locus]*weight
+            locus_weights += weight
+        open_cells = ~is_locus
+        open_count = sumOfNeighbors(open_cells.astype(float))
+        
+        cont = True
+        while cont:
+            positive = self.values > 0
+            cont = not positive.all()
+            xs, ys = NP.nonzero(positive)
+            x0 = (xs + self.np_random.integers(-1, 2, size=len(xs))) % width
+            y0 = (ys + self.np_random.integers(-1, 2, size=len(ys))) % width
+            targets = NP.zeros([width, width], dtype=bool)
+            targets[x0, y0] = True
+            targets &= open_cells
+            neighbor_sum = sumOfNeighbors(self.values*open_cells)
+            tmp = self.values.copy()
+            tmp[targets] = (neighbor_sum[targets] + locus_sum[targets])/(open_count[targets] + locus_weights[targets])
+            self.values = tmp
+    
+    def generateWithLociIterative(self):
         cont = True
         # set the landscape up
         while cont :
@@ -75,8 +204,8 @@ class Landscape(object):
                 for y in range(width):
                     if self.values[x,y]>0:
                         c = 0
-                        dx = RD.randint(-1, 1)
-                        dy = RD.randint(-1, 1)
+                        dx = self.random.randint(-1, 1)
+                        dy = self.random.randint(-1, 1)
                         x0 = (x+dx)%width
                         y0 = (y+dy)%width
                         if self.loci.count((x0,y0))==0:
@@ -120,12 +249,12 @@ class Landscape(object):
         return locus
     
     def normalizeTo(self, max_norm = 1.0, min_norm = 1.0):
-        tmp = self.values.copy()
-        for x in range(width):
-            for y in range(width):
-                tmp[x,y] = self.values[x,y]*(max_norm - min_norm) + min_norm
-                
-        return tmp
+        return self.values*(max_norm - min_norm) + min_norm
+
+def sumOfNeighbors(values):
+    # toroidal 3x3 neighborhood sum (including the cell itself) of a 2D array
+    rows = values + NP.roll(values, 1, axis=0) + NP.roll(values, -1, axis=0)
+    return rows + NP.roll(rows, 1, axis=1) + NP.roll(rows, -1, axis=1)
 
 def dsquaredBetween(p0,p1):
     x0, y0 = p0
@@ -0,0 +1,62 @@
+""" ledger.py
+The world's record of BRN food debts between households, keyed by household ID.
+
+Debts are kept both ways, like the per-household commitments dictionaries they
+replace: owed[a][b] is what household a owes household b, and owed[b][a] is
+always its negative.  Each household's prestige (the net amount owed to it) is
+kept up to date on every transfer, so reading it never scans the ledger.
+"""
+
+class DebtLedger(object):
+
+    def __init__(self):
+        self.owed = {}      # debtor ID -> {creditor ID -> amount owed}
+        self.prestige = {}  # household ID -> net amount owed to the household
+
+    def record(self, debtor, creditor, amount):
+        # debtor received amount from creditor
+        debts = self.owed.get(debtor)
+        if debts is None:
+            debts = self.owed[debtor] = {}
+        credits = self.owed.get(creditor)
+        if credits is None:
+            credits = self.owed[creditor] = {}
+        if debtor not in credits:
+            credits[debtor] = 0
+        if creditor not in debts:
+            debts[creditor] = 0
+        debts[creditor] += amount
+        credits[debtor] -= amount
+        self.prestige[debtor] = self.prestige.get(debtor, 0) - amount
+        self.prestige[creditor] = self.prestige.get(creditor, 0) + amount
+
+    def debt(self, debtor, creditor):
+        debts = self.owed.get(debtor)
+        if debts is None:
+            return 0
+        return debts.get(creditor, 0)
+
+    def prestigeOf(self, ID):
+        return self.prestige.get(ID, 0)
+
+    def creditFrom(self, creditor, households):
+        # the total the given households owe to creditor
+        credits = self.owed.get(creditor)
+        total = 0
+        if credits:
+            for hh in households:
+                if hh.ID in credits:
+                    total -= credits[hh.ID]
+        return total
+
+    def remove(self, ID):
+        # settles every debt of a household that has left the world
+        debts = self.owed.pop(ID, None)
+        self.prestige.pop(ID, None)
+        if debts:
+            for other, amount in debts.items():
+                del self.owed[other][ID]
+                self.prestige[other] -= amount  # the settled debt no longer counts toward other's prestige
+                if not self.owed[other]:
+                    del self.owed[other]
+                    del self.prestige[other]
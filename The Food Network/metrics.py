@@ -0,0 +1,124 @@
+""" metrics.py
+A registry of the measurements a world can take each step, and a recorder that
+takes only the ones an experiment asks for.
+
+Without a recorder, World.step computes every measurement every step and
+appends it to the world's lists (populations, avg_hoover, median_storage, ...),
+which is what the GUI plots.  With a recorder, World.step computes only the
+measurements due that step, and only collects per-household and per-forager
+values (storage, prestige, kinship spans, expertise) on steps when a due
+measurement needs them.  Each measurement is written into a preallocated
+array, one entry per sample.
+"""
+
+import collections
+import numpy as NP
+import utility as U
+
+# what World.step can collect while it steps the households
+STORAGE = 'storage'      # world.hh_food_stored
+PRESTIGE = 'prestige'    # world.hh_prestige
+MEMBERS = 'members'      # world.kinship_spans and world.pop_expertise
+COLLECTIONS = frozenset([STORAGE, PRESTIGE, MEMBERS])
+
+class Measurement(object):
+    """ One or more metrics computed together by function(world), which returns a tuple if there are more. """
+
+    def __init__(self, names, function, collections=()):
+        self.names = names
+        self.function = function
+        self.collections = frozenset(collections)
+
+METRICS = collections.OrderedDict()  # metric name -> the measurement that computes it
+
+def register(names, function, collections=()):
+    if isinstance(names, str):
+        names = [names]
+    measurement = Measurement(names, function, collections)
+    for name in names:
+        METRICS[name] = measurement
+    return measurement
+
+def hoover(world):
+    return world.hooverMetrics()
+
+def prestige(world):
+    if world.hh_prestige:
+        return max(world.hh_prestige), U.mean(world.hh_prestige)
+    return 0, 0
+
+register('population', lambda world: world.population)
+register('households', lambda world: world.householdCount())
+register('avg_pop_100', lambda world: world.avg_pop_100[-1])
+register('avg_hh_age', lambda world: world.tot_hh_age/world.dead_houses)
+register('avg_hh_size', lambda world: world.avg_hh_size[-1])
+register('food_shared', lambda world: world.food_shared_step)
+register('com_sharing', lambda world: world.com_sharing[-1])
+register('grn_sharing', lambda world: world.grn_sharing[-1])
+register('brn_sharing', lambda world: world.brn_sharing[-1])
+register('avg_age_at_death', lambda world: world.ages_at_death.mean())
+register('avg_adult_age_at_death', lambda world: world.adult_ages_at_death.mean())
+register(['max_hoover', 'avg_hoover'], hoover)
+register('median_storage', lambda world: U.median(world.hh_food_stored), [STORAGE])
+register('avg_food_stored', lambda world: U.mean(world.hh_food_stored), [STORAGE])
+register(['max_prestige', 'avg_prestige'], prestige, [PRESTIGE])
+register('avg_kinship_span', lambda world: U.mean(world.kinship_spans), [MEMBERS])
+register('avg_expertise', lambda world: U.mean(world.pop_expertise), [MEMBERS])
+
+class MetricsRecorder(object):
+
+    def __init__(self, steps=1000):
+        self.steps = steps  # how many steps a run is expected to take, to size the arrays
+        self.schedule = collections.OrderedDict()  # metric name -> (first step, interval)
+        self.samples = {}  # metric name -> array of samples
+        self.counts = {}   # metric name -> how many samples have been taken
+
+    def request(self, name, start=1, interval=1):
+        """ Sample the named metric after step start, and every interval steps after that. """
+        if name not in METRICS:
+            raise ValueError("unknown metric %r"%(name,))
+        start = max(1, start)  # nothing is measured before the first step
+        self.schedule[name] = (start, interval)
+        self.samples[name] = NP.empty(len(range(start, self.steps + 1, interval)))
+        self.counts[name] = 0
+
+    def isDue(self, name, step):
+        start, interval = self.schedule[name]
+        return step >= start and (step - start) % interval == 0
+
+    def due(self, step):
+        return [name for name in self.schedule if self.isDue(name, step)]
+
+    def collectionsDue(self, step):
+        # what World.step must collect this step for the metrics due
+        needed = set()
+        for name in self.due(step):
+            needed |= METRICS[name].collections
+        return needed
+
+    def record(self, world, step):
+        measured = {}
+        for name in self.due(step):
+            measurement = METRICS[name]
+            if measurement not in measured:
+                measured[measurement] = measurement.function(world)
+            value = measured[measurement]
+            if len(measurement.names) > 1:
+                value = value[measurement.names.index(name)]
+            self.store(name, value)
+
+    def store(self, name, value):
+        samples = self.samples[name]
+        count = self.counts[name]
+        if count == len(samples):  # the run went on longer than expected
+            samples = self.samples[name] = NP.concatenate([samples, NP.empty(max(1, len(samples)))])
+        samples[count] = value
+        self.counts[name] = count + 1
+
+    def values(self, name):
+        """ The samples of the named metric taken so far, oldest first. """
+        return self.samples[name][:self.counts[name]]
+
+    def sampledSteps(self, name):
+        start, interval = self.schedule[name]
+        return NP.arange(self.counts[name])*interval + start
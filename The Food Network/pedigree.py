@@ -0,0 +1,75 @@
+""" pedigree.py
+A world-level table of who descends from whom, by forager ID.
+
+Foragers are numbered consecutively from 0 within a world, so the table is a
+set of flat arrays indexed by ID: the IDs of both parents (-1 for founders) and
+the birth generation.  Only integers are stored, so a dead forager can be
+garbage collected as soon as no living agent refers to it.
+"""
+
+from array import array
+
+NO_PARENT = -1
+
+class Pedigree(object):
+
+    def __init__(self, memoize=True):
+        self.parent0 = array('l')
+        self.parent1 = array('l')
+        self.generation = array('l')
+        self.memoize = memoize
+        self.memo = {}  # ID -> {generations -> frozenset of ancestor IDs}
+
+    def __len__(self):
+        return len(self.parent0)
+
+    def add(self, ID, parent_ids=()):
+        if ID != len(self.parent0):
+            raise ValueError("forager %d added out of order; expected ID %d"%(ID, len(self.parent0)))
+        if len(parent_ids) == 2:
+            p0, p1 = parent_ids
+            generation = 1 + max(self.generation[p0], self.generation[p1])
+        else:
+            p0 = p1 = NO_PARENT
+            generation = 0
+        self.parent0.append(p0)
+        self.parent1.append(p1)
+        self.generation.append(generation)
+
+    def parentsOf(self, ID):
+        return [p for p in (self.parent0[ID], self.parent1[ID]) if p != NO_PARENT]
+
+    def ancestors(self, ID, generations):
+        """ The IDs of every ancestor of ID at most the given number of generations back. """
+        memo = self.memo.get(ID)
+        if memo is not None and generations in memo:
+            return memo[generations]
+        found = set()
+        frontier = [ID]
+        for i in range(generations):
+            parents = []
+            for j in frontier:
+                if self.parent0[j] != NO_PARENT:
+                    parents.append(self.parent0[j])
+                    parents.append(self.parent1[j])
+            if not parents:
+                break
+            found.update(parents)
+            frontier = parents
+        found = frozenset(found)
+        if self.memoize:
+            if memo is None:
+                memo = self.memo[ID] = {}
+            memo[generations] = found
+        return found
+
+    def areKin(self, a, a_generations, b, b_generations):
+        """
+        The IDs that a and b share among themselves and their ancestors, each traced back
+        their own number of generations; empty (false) if they are not kin.
+        """
+        return (self.ancestors(a, a_generations) | {a}) & (self.ancestors(b, b_generations) | {b})
+
+    def forget(self, ID):
+        # drops memoized ancestor sets of a forager that will not be asked about again
+        self.memo.pop(ID, None)
@@ -0,0 +1,96 @@
+""" pool.py
+Optional recycling of dead agents, and garbage collector scheduling, for long
+simulation runs.
+
+When pooling is on, foragers that die and households that leave the world are
+kept and reinitialized (all of their state is reset by calling __init__ again)
+the next time an agent of the same class is needed, instead of being freed and
+allocated anew.  Agents released during a step only become reusable once the
+step is over, since lists built earlier in the step may still refer to them.
+"""
+
+import gc
+
+class AgentPool(object):
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.free = {}     # class -> agents ready to be reused
+        self.pending = []  # agents released during the current step
+        self.created = 0   # agents allocated since the last resetCounts()
+        self.reused = 0    # agents recycled since the last resetCounts()
+
+    def make(self, cls, *args, **kwargs):
+        free = self.free.get(cls)
+        if free:
+            agent = free.pop()
+            agent.__init__(*args, **kwargs)
+            self.reused += 1
+        else:
+            agent = cls(*args, **kwargs)
+            self.created += 1
+        return agent
+
+    def release(self, agent):
+        if self.enabled:
+            self.pending.append(agent)
+
+    def recycle(self):
+        for agent in self.pending:
+            cls = type(agent)
+            if cls not in self.free:
+                self.free[cls] = []
+            self.free[cls].append(agent)
+        self.pending = []
+
+    def resetCounts(self):
+        self.created = 0
+        self.reused = 0
+
+# the collector's state is the process's, so it is shared by every schedule taking it over
+holding = 0              # schedules that have turned automatic collection off
+enabled_before = True    # whether it was on before the first of them did
+freezing = 0             # schedules that have frozen what was allocated before them
+
+class GCSchedule(object):
+    """
+    With an interval of 0 the garbage collector is left as it is.  With an interval of n > 0,
+    automatic collection is turned off and a full collection runs every n steps instead;
+    agents hold few reference cycles, so most garbage is freed by reference counting anyway.
+    freeze moves everything allocated so far (the landscape, the founding population) out of
+    the collector's view so later collections don't rescan it.  release() undoes both once the
+    last schedule that did them is released, and does nothing for a schedule that did neither.
+    """
+
+    def __init__(self, interval=0, freeze=False):
+        global holding, enabled_before, freezing
+        self.interval = interval
+        self.freeze = freeze
+        self.steps = 0
+        if interval > 0:
+            if holding == 0:
+                enabled_before = gc.isenabled()
+            holding += 1
+            gc.disable()
+        if freeze:
+            freezing += 1
+            gc.freeze()
+
+    def release(self):
+        global holding, freezing
+        if self.interval > 0:
+            holding -= 1
+            if holding == 0 and enabled_before:
+                gc.enable()
+        if self.freeze:
+            freezing -= 1
+            if freezing == 0:
+                gc.unfreeze()
+        self.interval = 0
+        self.freeze = False
+
+    def step(self):
+        if self.interval > 0:
+            self.steps += 1
+            if self.steps % self.interval == 0:
+                gc.collect()
@@ -0,0 +1,329 @@
+""" snapshot.py
+Saving a world to a file, and restoring it, so a long run can be checkpointed
+and resumed (World.save_snapshot and World.load_snapshot).
+
+A snapshot is a NumPy .npz archive of flat arrays: the landscape's resources,
+one array per household and forager field, the members of each household as a
+flat list of forager IDs with a count per household, the pedigree, the debts in
+the ledger and the metric histories.  A JSON header (stored in the archive as an
+array of bytes) holds the format version, the configuration, the scalar
+counters and the state of every random number stream, including the bounded
+normal draws already made but not yet used.  No objects are pickled.
+
+A restored world steps exactly as the saved one would have: households are kept
+in the same order, residents of each cell in the same order of arrival, and
+debts in the same order, since all of these decide the order of later draws and
+sums.  Caches (kin sets, memoized neighborhoods and ancestries, the agent pool)
+are not saved, and are rebuilt as they are needed, so only the counts of pooled
+agents (agents_created and agents_reused) can differ after a restore.
+"""
+
+import collections
+import json
+import os
+import numpy as NP
+import arrayengine as AE
+import config as C
+import forager as F
+import hhagent as HH
+import ledger as D
+import metrics as M
+import pedigree as P
+import pool as A
+import spatial as S
+import streams as R
+import utility as U
+import world as W
+
+FORMAT = 'food-network-snapshot'
+VERSION = 1
+
+NO_ONE = -1
+
+# the world's lists of per-step metrics, and of the values collected in the last step
+HISTORIES = ['populations', 'avg_pop', 'avg_pop_100', 'avg_hh_size', 'avg_hh_age', 'food_shared',
+             'food_shared_totals', 'com_sharing', 'brn_sharing', 'grn_sharing', 'avg_ages', 'avg_adult_ages',
+             'hh_prestige', 'median_storage', 'max_hoover', 'avg_hoover', 'avg_food_stored', 'agents_created',
+             'agents_reused', 'kinship_spans', 'hh_food_stored', 'pop_expertise', 'max_prestige', 'lineages',
+             'avg_hh_x', 'avh_hh_y']
+
+# the world's scalar counters
+COUNTERS = ['time', 'next_forager_ID', 'next_household_ID', 'population', 'population_total',
+            'population_window_total', 'tot_hh_age', 'dead_houses', 'food_shared_total']
+
+HISTOGRAMS = ['ages_at_death', 'adult_ages_at_death']
+
+HOUSEHOLD_FIELDS = ['ID', 'lineage', 'food_storage', 'food_needs', 'age', 'food_required', 'hungry',
+                    'foraging_ability']
+MEMBER_LISTS = ['parents', 'children', 'adoptees']
+FORAGER_FIELDS = ['ID', 'lineage', 'innate_foraging_expertise', 'kinship_span', 'age', 'max_age', 'alive',
+                  'food_need', 'amount_fed']
+
+def plain(value):
+    # a NumPy scalar (the array engine's counters are) as the Python number JSON can hold
+    return value.item() if isinstance(value, NP.generic) else value
+
+def save(world, path):
+    arrays = {}
+    header = {'format': FORMAT,
+              'version': VERSION,
+              'config': world.config._asdict(),
+              'engine': 'array' if world.engine is not None else 'object',
+              'counters': dict((name, plain(getattr(world, name))) for name in COUNTERS),
+              'population_window': [plain(population) for population in world.population_window],
+              'histograms': {},
+              'gc_steps': world.gc.steps,
+              'streams': saveStreams(world.streams)}
+    arrays['foraging_resources'] = world.foraging_resources
+    arrays['max_foraging_resources'] = world.max_foraging_resources
+    arrays['regrowth_rate'] = world.regrowth_rate
+    for name in HISTORIES:
+        arrays['history/' + name] = NP.asarray(getattr(world, name))
+    for name in HISTOGRAMS:
+        histogram = getattr(world, name)
+        arrays['histogram/' + name] = NP.array(histogram.counts, dtype=int)
+        header['histograms'][name] = [histogram.count, plain(histogram.total)]
+    for name in ('parent0', 'parent1', 'generation'):
+        arrays['pedigree/' + name] = NP.array(getattr(world.pedigree, name), dtype=int)
+    saveLedger(world.ledger, arrays)
+    if world.engine is not None:
+        saveEngine(world.engine, arrays)
+    else:
+        saveAgents(world, arrays)
+    if world.recorder is not None:
+        header['recorder'] = saveRecorder(world.recorder, arrays)
+    arrays['header'] = NP.frombuffer(json.dumps(header).encode('utf-8'), dtype=NP.uint8)
+    # written to a temporary file first, so an interrupted save never leaves a broken snapshot
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as f:
+        NP.savez_compressed(f, **arrays)
+    os.replace(temp_path, path)
+
+def load(path):
+    with NP.load(path) as archive:
+        arrays = dict((name, archive[name]) for name in archive.files)
+    header = json.loads(arrays['header'].tobytes().decode('utf-8'))
+    if header.get('format') != FORMAT:
+        raise ValueError("%s is not a world snapshot"%(path,))
+    if header['version'] != VERSION:
+        raise ValueError("%s is a version %s snapshot; only version %d can be read"%(path, header['version'], VERSION))
+    config = C.SimConfig(**header['config'])
+
+    world = W.World.__new__(W.World)
+    world.config = config
+    world.streams = loadStreams(header['streams'])
+    world.recorder = loadRecorder(header['recorder'], arrays) if 'recorder' in header else None
+    for name, value in header['counters'].items():
+        setattr(world, name, value)
+    world.foraging_resources = arrays['foraging_resources']
+    world.max_foraging_resources = arrays['max_foraging_resources']
+    world.regrowth_rate = arrays['regrowth_rate']
+    for name in HISTORIES:
+        setattr(world, name, arrays['history/' + name].tolist())
+    world.population_window = collections.deque(header['population_window'], maxlen=100)
+    for name in HISTOGRAMS:
+        histogram = U.IntegerHistogram()
+        histogram.counts = arrays['histogram/' + name].tolist()
+        histogram.count, histogram.total = header['histograms'][name]
+        setattr(world, name, histogram)
+
+    world.pool = A.AgentPool(enabled=config.pooling)
+    world.gc = A.GCSchedule(config.gc_interval, config.gc_freeze)
+    world.gc.steps = header['gc_steps']
+    world.pedigree = P.Pedigree()
+    for name in ('parent0', 'parent1', 'generation'):
+        getattr(world.pedigree, name).extend(arrays['pedigree/' + name].tolist())
+    world.ledger = loadLedger(arrays)
+    world.spatial = S.SpatialIndex(config.width)
+    world.hh_locations = world.spatial.location
+    world.houses_by_loc = world.spatial.cells
+    world.kin_index = {}
+    if header['engine'] == 'array':
+        world.households = []
+        world.engine = loadEngine(world, arrays)
+    else:
+        world.engine = None
+        loadAgents(world, arrays)
+        world.updateBestLocations()
+    return world
+
+"""
+random number streams
+"""
+def saveStreams(streams):
+    state = {'root_seed': streams.root_seed, 'job': streams.job, 'repetition': streams.repetition}
+    for name in R.STREAM_NAMES:
+        stream = getattr(streams, name)
+        state[name] = {'random': stream.getstate(),
+                       'np': stream.np.bit_generator.state,
+                       'normals': [[list(key), samples, index] for key, (samples, index) in stream.normals.buffers.items()]}
+    return state
+
+def loadStreams(state):
+    streams = R.RandomStreams(state['root_seed'], state['job'], state['repetition'])
+    for name in R.STREAM_NAMES:
+        stream = getattr(streams, name)
+        version, internal, gauss_next = state[name]['random']
+        stream.setstate((version, tuple(internal), gauss_next))
+        stream.np.bit_generator.state = state[name]['np']
+        for key, samples, index in state[name]['normals']:
+            stream.normals.buffers[tuple(key)] = [samples, index]
+    return streams
+
+"""
+agents
+"""
+def flatten(lists, arrays, name):
+    # a list of lists, as the concatenated lists and their lengths
+    arrays[name] = NP.array([item for items in lists for item in items], dtype=int)
+    arrays[name + '_count'] = NP.array([len(items) for items in lists], dtype=int)
+
+def unflatten(arrays, name):
+    items = arrays[name].tolist()
+    ends = NP.cumsum(arrays[name + '_count']).tolist()
+    return [items[end - count:end] for count, end in zip(arrays[name + '_count'].tolist(), ends)]
+
+def saveAgents(world, arrays):
+    households = world.households
+    # every forager a household refers to: its members, the baby it is expecting, and their mates
+    foragers = collections.OrderedDict()
+    for hh in households:
+        for member in hh.members():
+            foragers[member.ID] = member
+        if hh.nextBaby is not None:
+            foragers[hh.nextBaby.ID] = hh.nextBaby
+    pending = list(foragers.values())
+    while pending:
+        mate = pending.pop().mate
+        if mate is not None and mate.ID not in foragers:
+            foragers[mate.ID] = mate
+            pending.append(mate)
+    foragers = list(foragers.values())
+
+    for name in HOUSEHOLD_FIELDS:
+        arrays['households/' + name] = NP.array([getattr(hh, name) for hh in households])
+    arrays['households/baby'] = NP.array([NO_ONE if hh.nextBaby is None else hh.nextBaby.ID for hh in households],
+                                         dtype=int)
+    for name in MEMBER_LISTS:
+        flatten([[member.ID for member in getattr(hh, name)] for hh in households], arrays, 'households/' + name)
+    cells = NP.array([world.hh_locations[hh] for hh in households], dtype=int).reshape(-1, 2)
+    arrays['households/x'] = cells[:, 0]
+    arrays['households/y'] = cells[:, 1]
+    # both orders the spatial index keeps: of first arrival in the world, and of arrival in each cell
+    arrays['spatial/location_order'] = NP.array([hh.ID for hh in world.spatial.location], dtype=int)
+    arrays['spatial/cell_order'] = NP.array([hh.ID for residents in world.spatial.cells.values() for hh in residents],
+                                            dtype=int)
+
+    for name in FORAGER_FIELDS:
+        arrays['foragers/' + name] = NP.array([getattr(forager, name) for forager in foragers])
+    arrays['foragers/lineage'] = NP.array([NO_ONE if forager.lineage is None else forager.lineage
+                                           for forager in foragers], dtype=int)
+    present = set([hh.ID for hh in households])
+    arrays['foragers/household'] = NP.array([forager.household.ID if forager.household is not None
+                                             and forager.household.ID in present else NO_ONE
+                                             for forager in foragers], dtype=int)
+    arrays['foragers/mate'] = NP.array([NO_ONE if forager.mate is None else forager.mate.ID for forager in foragers],
+                                       dtype=int)
+
+def loadAgents(world, arrays):
+    foragers = {}
+    fields = dict((name, arrays['foragers/' + name].tolist()) for name in FORAGER_FIELDS)
+    for i in range(len(fields['ID'])):
+        forager = F.Forager.__new__(F.Forager)
+        forager.world = world
+        for name in FORAGER_FIELDS:
+            setattr(forager, name, fields[name][i])
+        if forager.lineage == NO_ONE:
+            forager.lineage = None
+        foragers[forager.ID] = forager
+    for ID, mate in zip(fields['ID'], arrays['foragers/mate'].tolist()):
+        foragers[ID].mate = foragers[mate] if mate != NO_ONE else None
+
+    households = {}
+    world.households = []
+    fields = dict((name, arrays['households/' + name].tolist()) for name in HOUSEHOLD_FIELDS)
+    members = dict((name, unflatten(arrays, 'households/' + name)) for name in MEMBER_LISTS)
+    babies = arrays['households/baby'].tolist()
+    for i in range(len(fields['ID'])):
+        hh = HH.HHAgent.__new__(HH.HHAgent)
+        hh.world = world
+        for name in HOUSEHOLD_FIELDS:
+            setattr(hh, name, fields[name][i])
+        for name in MEMBER_LISTS:
+            setattr(hh, name, [foragers[ID] for ID in members[name][i]])
+        hh.nextBaby = foragers[babies[i]] if babies[i] != NO_ONE else None
+        hh.kin_set = None
+        hh.member_list = tuple(hh.parents + hh.children + hh.adoptees)
+        households[hh.ID] = hh
+        world.households.append(hh)
+    for ID, household in zip(arrays['foragers/ID'].tolist(), arrays['foragers/household'].tolist()):
+        foragers[ID].household = households[household] if household != NO_ONE else None
+
+    cells = dict(zip(fields['ID'], zip(arrays['households/x'].tolist(), arrays['households/y'].tolist())))
+    for ID in arrays['spatial/location_order'].tolist():
+        world.spatial.location[households[ID]] = cells[ID]
+    for ID in arrays['spatial/cell_order'].tolist():
+        world.spatial.cells[cells[ID]][households[ID]] = None
+
+def saveEngine(engine, arrays):
+    for name, dtype, initial in AE.FORAGER_FIELDS:
+        arrays['engine/' + name] = getattr(engine, name)[:engine.f_count]
+    for name, dtype, initial in AE.HOUSEHOLD_FIELDS:
+        arrays['engine/' + name] = getattr(engine, name)[:engine.h_count]
+    flatten(engine.h_parents, arrays, 'engine/h_parents')
+    flatten(engine.h_children, arrays, 'engine/h_children')
+    arrays['engine/h_cell'] = NP.array(engine.h_cell, dtype=int).reshape(-1, 2)
+    arrays['engine/cell_order'] = NP.array([h for residents in engine.cells.values() for h in residents], dtype=int)
+
+def loadEngine(world, arrays):
+    engine = AE.ArrayEngine(world, 0, [])
+    engine.f_count = len(arrays['engine/f_age'])
+    engine.h_count = len(arrays['engine/h_age'])
+    for fields, count in ((AE.FORAGER_FIELDS, engine.f_count), (AE.HOUSEHOLD_FIELDS, engine.h_count)):
+        engine.allocate(fields, max(16, 2*count))
+        for name, dtype, initial in fields:
+            if 'engine/' + name in arrays:  # fields added since the snapshot was saved keep their initial values
+                getattr(engine, name)[:count] = arrays['engine/' + name]
+    engine.h_parents = unflatten(arrays, 'engine/h_parents')
+    engine.h_children = unflatten(arrays, 'engine/h_children')
+    engine.h_cell = [tuple(cell) for cell in arrays['engine/h_cell'].tolist()]
+    for h in arrays['engine/cell_order'].tolist():
+        engine.cells[engine.h_cell[h]].append(h)
+    return engine
+
+"""
+ledger and recorder
+"""
+def saveLedger(ledger, arrays):
+    # in the ledger's own order, since settling a household's debts follows it
+    debts = [(debtor, creditor, amount) for debtor, owed in ledger.owed.items() for creditor, amount in owed.items()]
+    arrays['ledger/debtor'] = NP.array([debt[0] for debt in debts], dtype=int)
+    arrays['ledger/creditor'] = NP.array([debt[1] for debt in debts], dtype=int)
+    arrays['ledger/amount'] = NP.array([debt[2] for debt in debts], dtype=float)
+    arrays['ledger/prestige_ID'] = NP.array(list(ledger.prestige.keys()), dtype=int)
+    arrays['ledger/prestige'] = NP.array(list(ledger.prestige.values()), dtype=float)
+
+def loadLedger(arrays):
+    ledger = D.DebtLedger()
+    for debtor, creditor, amount in zip(arrays['ledger/debtor'].tolist(), arrays['ledger/creditor'].tolist(),
+                                        arrays['ledger/amount'].tolist()):
+        ledger.owed.setdefault(debtor, {})[creditor] = amount
+    ledger.prestige = dict(zip(arrays['ledger/prestige_ID'].tolist(), arrays['ledger/prestige'].tolist()))
+    return ledger
+
+def saveRecorder(recorder, arrays):
+    for name in recorder.schedule:
+        arrays['recorder/' + name] = recorder.values(name)
+    return {'steps': recorder.steps,
+            'schedule': [[name, start, interval] for name, (start, interval) in recorder.schedule.items()],
+            'capacity': dict((name, len(samples)) for name, samples in recorder.samples.items())}
+
+def loadRecorder(state, arrays):
+    recorder = M.MetricsRecorder(state['steps'])
+    for name, start, interval in state['schedule']:
+        recorder.schedule[name] = (start, interval)
+        values = arrays['recorder/' + name]
+        recorder.samples[name] = NP.empty(state['capacity'][name])
+        recorder.samples[name][:len(values)] = values
+        recorder.counts[name] = len(values)
+    return recorder
@@ -0,0 +1,124 @@
+""" spatial.py
+A spatial index of the households on the toroidal landscape grid.
+
+Each cell keeps its residents in an insertion-ordered dictionary, so that
+insert, remove and move are all O(1) while residents are still listed in the
+order they arrived (the order the original per-cell lists had).  The cells
+within a given radius of each cell are computed once per radius and reused by
+every later query.
+
+Neighborhood queries are memoized per (cell, radius).  A cached neighborhood
+is dropped as soon as a resident enters or leaves any cell within its radius,
+so a cached answer is always the same as a fresh one.
+"""
+
+import math
+
+class SpatialIndex(object):
+
+    def __init__(self, width):
+        self.width = width
+        self.cells = {}     # cell -> residents, as an ordered dict of resident -> None
+        self.location = {}  # resident -> cell
+        self.offsets = {}   # radius -> disc offsets (dx, dy), dx-major like the original queries
+        self.discs = {}     # radius -> {cell -> list of the residents dicts of the cells within radius}
+        self.buffer = []    # reused by within() when the caller doesn't supply a list
+        self.memo = {}      # radius -> {cell -> tuple of the residents within radius}
+        self.hits = 0
+        self.misses = 0
+        for x in range(width):
+            for y in range(width):
+                self.cells[x,y] = {}
+
+    def insert(self, resident, cell):
+        self.cells[cell][resident] = None
+        self.location[resident] = cell
+        self.invalidate(cell)
+
+    def remove(self, resident):
+        cell = self.location.pop(resident)
+        del self.cells[cell][resident]
+        self.invalidate(cell)
+        return cell
+
+    def move(self, resident, cell):
+        old = self.location[resident]
+        del self.cells[old][resident]
+        self.cells[cell][resident] = None
+        self.location[resident] = cell
+        self.invalidate(old)
+        self.invalidate(cell)
+        return old
+
+    def invalidate(self, cell):
+        # the disc is symmetric: the neighborhoods that include cell are those centered within radius of it
+        for radius, memo in self.memo.items():
+            if memo:
+                for around in self.cellsAround(cell, radius):
+                    memo.pop(around, None)
+
+    def clearMemo(self):
+        for memo in self.memo.values():
+            memo.clear()
+
+    def locationOf(self, resident):
+        return self.location[resident]
+
+    def discOffsets(self, radius):
+        if radius not in self.offsets:
+            r_squared = radius*radius
+            self.offsets[radius] = [(dx, dy) for dx in range(-radius, radius+1)
+                                    for dy in range(-radius, radius+1) if (dx**2 + dy**2) <= r_squared]
+        return self.offsets[radius]
+
+    def wrap(self, cell, offset):
+        return ((cell[0] + offset[0]) % self.width, (cell[1] + offset[1]) % self.width)
+
+    def distanceBetween(self, p0, p1):
+        # landscape.distanceBetween, on this index's grid
+        dx = abs(p0[0] - p1[0])
+        if dx > self.width/2:
+            dx = self.width - dx
+        dy = abs(p0[1] - p1[1])
+        if dy > self.width/2:
+            dy = self.width - dy
+        return math.sqrt(dx**2 + dy**2)
+    
+    def cellsAround(self, cell, radius):
+        return [self.wrap(cell, offset) for offset in self.discOffsets(radius)]
+
+    def neighbors(self, cell, radius):
+        """ Every resident within radius of cell, as a memoized tuple in the same order as within(). """
+        memo = self.memo.get(radius)
+        if memo is None:
+            memo = self.memo[radius] = {}
+        found = memo.get(cell)
+        if found is None:
+            self.misses += 1
+            found = memo[cell] = tuple(self.within(cell, radius))
+        else:
+            self.hits += 1
+        return found
+
+    def residentsAround(self, cell, radius):
+        # the residents dicts of every cell within radius of cell, cached per radius and cell
+        disc = self.discs.get(radius)
+        if disc is None:
+            disc = self.discs[radius] = {}
+        around = disc.get(cell)
+        if around is None:
+            around = disc[cell] = [self.cells[c] for c in self.cellsAround(cell, radius)]
+        return around
+
+    def within(self, cell, radius, out=None):
+        """
+        Every resident within radius of cell, in cell order and then arrival order.
+        The result is written into out, or into this index's reusable buffer if out is None;
+        either way the list is overwritten by the next call that uses it.
+        """
+        if out is None:
+            out = self.buffer
+        del out[:]
+        for residents in self.residentsAround(cell, radius):
+            out.extend(residents)
+        return out
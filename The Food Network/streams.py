@@ -0,0 +1,45 @@
+""" streams.py
+The random number streams of a world.
+
+Every world draws from its own streams, one for each kind of decision, so that
+worlds in the same process never disturb each other, and changing how often one
+kind of decision draws leaves the others unchanged.  The streams are derived
+from a root seed and a job and repetition number, so any repetition of any job
+can be rerun on its own, in any process, and draw exactly the same numbers.
+"""
+
+import random
+import numpy as NP
+import utility as U
+
+# landscape:  generating the landscape, when the world isn't given one
+# activation: the order households act in each step
+# demography: founders' ages, births, expertise and kinship spans, and mate choice
+# movement:   where households settle and move, and the order they meet their neighbors
+STREAM_NAMES = ('landscape', 'activation', 'demography', 'movement')
+
+class Stream(random.Random):
+    """
+    A random.Random, plus a NumPy Generator (np) and a pool of bounded normal draws
+    (normals) for batched draws, all seeded from the same SeedSequence.
+    """
+
+    def __init__(self, seed_sequence):
+        super().__init__(int.from_bytes(seed_sequence.generate_state(4, NP.uint64).tobytes(), 'little'))
+        self.np = NP.random.Generator(NP.random.PCG64(seed_sequence))
+        self.normals = U.BoundedNormalPool(rng=self.np)
+
+def freshSeed():
+    return NP.random.SeedSequence().entropy
+
+class RandomStreams(object):
+
+    def __init__(self, root_seed=None, job=0, repetition=0):
+        if root_seed is None:
+            root_seed = freshSeed()  # fresh, but recorded so the run can be repeated
+        self.root_seed = root_seed
+        self.job = job
+        self.repetition = repetition
+        sequence = NP.random.SeedSequence([root_seed, job, repetition])
+        for name, child in zip(STREAM_NAMES, sequence.spawn(len(STREAM_NAMES))):
+            setattr(self, name, Stream(child))
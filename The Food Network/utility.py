@@ -1,6 +1,7 @@
 import datetime as DT
 import random
 import math
+import numpy as NP
 
 #a utility function that can generate a random number using a normal distribution with lower and upper bounds
 def randomBoundedNormal(meanVal,stdDev,lowerBound,upperBound):
@@ -15,13 +16,129 @@ def GenBoundedRandomNormal(meanVal,stdDev,lowerBound,upperBound):
         aRand = random.gauss(meanVal,stdDev)
     return aRand
 
+def boundedNormalArray(meanVal, stdDev, lowerBound, upperBound, n, rng=NP.random):
+    """
+    n draws from a normal distribution with lower and upper bounds, as an array.  Like
+    randomBoundedNormal, draws outside the bounds are rejected and redrawn, but all of the
+    draws are made at once.  rng is anything with NumPy's normal(), e.g. a Generator.
+    """
+    samples = rng.normal(meanVal, stdDev, n)
+    rejected = NP.flatnonzero((samples < lowerBound) | (samples > upperBound))
+    while len(rejected):
+        redrawn = rng.normal(meanVal, stdDev, len(rejected))
+        samples[rejected] = redrawn
+        rejected = rejected[(redrawn < lowerBound) | (redrawn > upperBound)]
+    return samples
+
+class BoundedNormalPool(object):
+    """
+    Bounded normal draws made batch_size at a time with boundedNormalArray, and handed out
+    one (draw) or many (take) at a time, with a separate buffer for each set of parameters.
+    """
+    
+    def __init__(self, batch_size=1024, rng=NP.random):
+        self.batch_size = batch_size
+        self.rng = rng
+        self.buffers = {}  # (mean, stddev, lower bound, upper bound) -> [samples, index of the next one]
+    
+    def draw(self, meanVal, stdDev, lowerBound, upperBound):
+        key = (meanVal, stdDev, lowerBound, upperBound)
+        buffer = self.buffers.get(key)
+        if buffer is None or buffer[1] == len(buffer[0]):
+            buffer = self.buffers[key] = [self.fill(key, self.batch_size).tolist(), 0]
+        sample = buffer[0][buffer[1]]
+        buffer[1] += 1
+        return sample
+    
+    def take(self, meanVal, stdDev, lowerBound, upperBound, n):
+        key = (meanVal, stdDev, lowerBound, upperBound)
+        buffer = self.buffers.get(key)
+        if buffer is None:
+            buffer = self.buffers[key] = [[], 0]
+        samples, start = buffer
+        if start + n > len(samples):
+            remaining = samples[start:]
+            samples = remaining + self.fill(key, max(self.batch_size, n - len(remaining))).tolist()
+            start = 0
+        buffer[0] = samples
+        buffer[1] = start + n
+        return NP.array(samples[start:start + n])
+    
+    def fill(self, key, n):
+        meanVal, stdDev, lowerBound, upperBound = key
+        return boundedNormalArray(meanVal, stdDev, lowerBound, upperBound, n, self.rng)
+
+class IntegerHistogram(object):
+    """
+    Counts of non-negative integer values, for the mean and median of a long series of small
+    integers (such as ages) in constant memory.  mean() and median() give exactly what mean
+    and median give for the list of values.
+    """
+    
+    def __init__(self):
+        self.counts = []
+        self.count = 0
+        self.total = 0
+    
+    def __len__(self):
+        return self.count
+    
+    def add(self, value):
+        if value >= len(self.counts):
+            self.counts.extend([0]*(value + 1 - len(self.counts)))
+        self.counts[value] += 1
+        self.count += 1
+        self.total += value
+    
+    def mean(self):
+        if self.count:
+            return self.total/self.count
+        else:
+            return 0
+    
+    def median(self):
+        if not self.count:
+            return 0
+        mid_idx = int(self.count/2)
+        seen = 0
+        for value, count in enumerate(self.counts):
+            seen += count
+            if seen > mid_idx:
+                return value
+
+# lists at least this long (and NumPy arrays of any length) are handed to the array kernels below
+fast_path_size = 256
+def setFastPathSize(val=fast_path_size):
+    global fast_path_size
+    fast_path_size = int(val)
+    return fast_path_size
+
+# The kernels add with NP.cumsum, which adds left to right exactly as sum() does up to Python 3.11,
+# so they give identical results.  Later versions of sum() compensate for rounding, so there only
+# median, which selects rather than adds, is routed to its kernel automatically.
+SEQUENTIAL_SUM = sum([1e16, 1.0, -1e16]) == 0.0
+
+def useArrays(values, adds=True):
+    if isinstance(values, NP.ndarray):
+        return True
+    return len(values) >= fast_path_size and (SEQUENTIAL_SUM or not adds)
+
+def total(values):
+    # sum(), left to right
+    return NP.cumsum(values)[-1] if len(values) else 0
+
 def mean(values):
+    if isinstance(values, NP.ndarray):  # sum() is as fast as any kernel on a list
+        return float(total(NP.asarray(values, dtype=float))/len(values)) if len(values) else 0
     if values:
         return sum(values)/len(values)
     else:
         return 0
 
 def variance(values):
+    if useArrays(values):
+        values = NP.asarray(values, dtype=float)
+        return mean((values - mean(values))**2)
     mu = mean(values)
     square_diffs = [(value-mu)**2 for value in values]
     return mean(square_diffs)
@@ -30,13 +147,25 @@ def standardDeviation(values):
     return math.sqrt(variance(values))
 
 def median(values):
-    if not values:
+    if len(values) == 0:
         return 0
+    if useArrays(values, adds=False):
+        # the same element sorting would put there, found by selection in O(n)
+        mid_idx = int(len(values)/2)
+        return NP.partition(NP.asarray(values), mid_idx)[mid_idx].item()
     sorted_values = sorted(values, key=lambda x: x)
     mid_idx=int(len(sorted_values)/2)
     return sorted_values[mid_idx]
 
 def HooverIndex(values):
+    if useArrays(values):
+        values = NP.asarray(values, dtype=float)
+        sum_values = total(values)
+        if sum_values==0:
+            return 0
+        avg = sum_values/len(values)
+        above_avg = values[values > avg]
+        return float((total(above_avg) - avg*len(above_avg))/sum_values)
     avg = mean(values)
     sum_values=sum(values)
     if sum_values==0:
@@ -46,6 +175,12 @@ def HooverIndex(values):
     return above_avg_sum/sum_values
 
 def GiniIndex(values):
+    if useArrays(values):
+        val_sort = NP.sort(NP.asarray(values, dtype=float))
+        n = len(val_sort)
+        sum_iy = total(NP.arange(n)*val_sort)
+        sum_y = total(val_sort)
+        return float(2*sum_iy/(n*sum_y) - (n+1)/n)
     val_sort = sorted(values, key=lambda val: val)
     n = len(values)
     sum_iy = sum([i*val_sort[i] for i in range(n)])
@@ -53,6 +188,67 @@ def GiniIndex(values):
     gini = 2*sum_iy/(n*sum_y) - (n+1)/n
     return gini
 
+"""
+Grouped kernels: each takes an array of values and an equally long array of group labels (cells,
+lineages, neighborhoods, ...), and returns the sorted distinct labels and an array with the
+statistic of each group's values, computed for every group at once.  Groups whose sum is 0 have
+a Gini index of nan.
+"""
+def groupIndex(groups):
+    labels, inverse, counts = NP.unique(NP.asarray(groups), return_inverse=True, return_counts=True)
+    return labels, inverse.ravel(), counts
+
+def sortedByGroup(values, inverse, counts):
+    # the values sorted within each group, groups in label order, and where each group starts
+    order = NP.lexsort((values, inverse))
+    starts = NP.concatenate([[0], NP.cumsum(counts)[:-1]])
+    return values[order], starts
+
+def groupedMean(values, groups):
+    labels, inverse, counts = groupIndex(groups)
+    return labels, NP.bincount(inverse, weights=NP.asarray(values, dtype=float))/counts
+
+def groupedVariance(values, groups):
+    values = NP.asarray(values, dtype=float)
+    labels, inverse, counts = groupIndex(groups)
+    means = NP.bincount(inverse, weights=values)/counts
+    return labels, NP.bincount(inverse, weights=(values - means[inverse])**2)/counts
+
+def groupedStandardDeviation(values, groups):
+    labels, variances = groupedVariance(values, groups)
+    return labels, NP.sqrt(variances)
+
+def groupedMedian(values, groups):
+    # median's element (the upper median) of each group
+    values = NP.asarray(values)
+    labels, inverse, counts = groupIndex(groups)
+    sorted_values, starts = sortedByGroup(values, inverse, counts)
+    return labels, sorted_values[starts + counts//2]
+
+def groupedHoover(values, groups):
+    values = NP.asarray(values, dtype=float)
+    labels, inverse, counts = groupIndex(groups)
+    sums = NP.bincount(inverse, weights=values)
+    avg = sums/counts
+    above = values > avg[inverse]
+    sums_above = NP.bincount(inverse[above], weights=values[above], minlength=len(labels))
+    counts_above = NP.bincount(inverse[above], minlength=len(labels))
+    with NP.errstate(divide='ignore', invalid='ignore'):
+        hoovers = (sums_above - avg*counts_above)/sums
+    return labels, NP.where(sums == 0, 0.0, hoovers)
+
+def groupedGini(values, groups):
+    values = NP.asarray(values, dtype=float)
+    labels, inverse, counts = groupIndex(groups)
+    sorted_values, starts = sortedByGroup(values, inverse, counts)
+    sorted_groups = NP.repeat(NP.arange(len(labels)), counts)
+    ranks = NP.arange(len(values)) - starts[sorted_groups]
+    sum_iy = NP.bincount(sorted_groups, weights=ranks*sorted_values)
+    sum_y = NP.bincount(sorted_groups, weights=sorted_values)
+    with NP.errstate(divide='ignore', invalid='ignore'):
+        ginis = 2*sum_iy/(counts*sum_y) - (counts+1)/counts
+    return labels, NP.where(sum_y == 0, NP.nan, ginis)
+
 def getTimeStampString():
     dt = DT.datetime.now()    
     timestamp_str = str(dt.year) + "-" + str("%02d"%dt.month) + "-"
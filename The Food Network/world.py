@@ -1,9 +1,19 @@
 
-import random as rnd
 import hhagent as HH
 import forager as F
+import arrayengine as AE
+import config as C
 import landscape as L
+import ledger as D
+import metrics as M
+import pedigree as P
+import pool as A
+import snapshot as SN
+import spatial as S
+import streams as R
 import utility as U
+import numpy as NP
+import collections
 import math
 
 DEFAULT_SIZE = 1
@@ -56,68 +66,111 @@ def setKinSpan(val=max_founder_kin_span):
 
 resource_zero = 0.1  # landscape resources can't actually go to zero or it won't regrow
 
+# recycle dead foragers and households instead of allocating new ones (see pool.py)
+pooling = False
+def setPooling(val=pooling):
+    global pooling
+    pooling = bool(val)
+    return pooling
+
+# 0 leaves garbage collection automatic; n>0 collects every n steps instead (see pool.GCSchedule)
+gc_interval = 0
+def setGCInterval(val=gc_interval):
+    global gc_interval
+    gc_interval = int(val)
+    return gc_interval
+
+gc_freeze = False
+def setGCFreeze(val=gc_freeze):
+    global gc_freeze
+    gc_freeze = bool(val)
+    return gc_freeze
+
+# root seed of every world's random number streams; None seeds each world afresh (see streams.py)
+random_seed = None
+def setRandomSeed(val=random_seed):
+    global random_seed
+    random_seed = None if val is None else int(val)
+    return random_seed
+
+# 'object' steps Forager and HHAgent objects; 'array' steps NumPy arrays instead (see arrayengine.py)
+simulation_engine = 'object'
+def setEngine(val=simulation_engine):
+    global simulation_engine
+    if val not in ('object', 'array'):
+        raise ValueError("unknown simulation engine %r"%(val,))
+    simulation_engine = val
+    return simulation_engine
+
 DEBUG=True
 
 def debug(s):
     if DEBUG:
         print(s)
 
-addlocs = lambda a,b: tuple((ax+bx)%L.width for ax,bx in zip(a,b))
+# the 3x3 neighborhood searched by World.bestLocationAt
+NEIGHBOR_OFFSETS = [(a, b) for a in range(-1, 2) for b in range(-1, 2)]
+NEIGHBOR_DX = NP.array([a for a, b in NEIGHBOR_OFFSETS])
+NEIGHBOR_DY = NP.array([b for a, b in NEIGHBOR_OFFSETS])
 
 class World(object):
        
-    def __init__(self, size=DEFAULT_SIZE, numagents=starting_agents, landscape = L.Landscape()):
-        HH.HHAgent.reset()
-        F.Forager.reset()
-        HH.world = self
-        F.world = self
+    def __init__(self, size=DEFAULT_SIZE, numagents=None, landscape=None, engine=None, streams=None, config=None,
+                 recorder=None):
+        if config is None:
+            config = C.default()
+        self.config = config  # every parameter the world and its agents read (see config.py)
+        if numagents is None:
+            numagents = config.starting_agents
+        if engine is None:
+            engine = config.simulation_engine
+        if streams is None:
+            streams = R.RandomStreams(config.random_seed)
+        self.streams = streams
+        if landscape is None:
+            landscape = L.Landscape(streams.landscape.getrandbits(32))
+        if landscape.values.shape != (config.width, config.width):
+            raise ValueError("landscape is %dx%d, but the configured width is %d"%(landscape.values.shape + (config.width,)))
+        self.next_forager_ID = 0
+        self.next_household_ID = 0
+        self.time = 0  # steps taken
+        self.recorder = recorder  # None records every metric every step (see metrics.py)
         
-        self.foraging_resources = landscape.normalizeTo(max_resource, min_resource)
+        self.foraging_resources = landscape.normalizeTo(config.max_resource, config.min_resource)
         self.max_foraging_resources = self.foraging_resources.copy()
         
-        self.hh_locations = {}
+        self.pool = A.AgentPool(enabled=config.pooling)
+        self.pedigree = P.Pedigree()
+        self.ledger = D.DebtLedger()
+        self.spatial = S.SpatialIndex(config.width)
+        self.hh_locations = self.spatial.location  # household -> cell
+        self.kin_index = {}  # ancestor ID -> households with that ID in their kin set
         self.avg_hh_x = []
         self.avh_hh_y = []
-        self.houses_by_loc = {}
-        self.regrowth_rate = {}
+        self.houses_by_loc = self.spatial.cells  # cell -> households, in order of arrival
+        # per-cell growth factor that takes a cell from resource_zero back to its maximum in regrowth_steps
+        # (computed once with math rather than NP so that the rates match the scalar formula exactly)
+        growth = lambda resource: math.exp((math.log(resource) - math.log(resource_zero))/config.regrowth_steps)
+        self.regrowth_rate = NP.array([[growth(resource) for resource in row] for row in self.max_foraging_resources])
         self.lineages = [i for i in range(numagents)]
         self.kinship_spans = []
         self.hh_food_stored = []
         self.pop_expertise = []
         self.max_prestige = []
-        for x in range(L.width):
-            for y in range(L.width):
-                self.houses_by_loc[x,y] = [] 
-                resource = self.max_foraging_resources[x,y] 
-                self.regrowth_rate[x,y] = math.exp((math.log(resource) - math.log(resource_zero))/regrowth_steps)
         
-        self.households = [HH.HHAgent() for i in range(numagents)]
-        avg_x = 0
-        avg_y = 0
-        span_interval = (max_founder_kin_span - min_founder_kin_span)/numagents
-        for hh in self.households:
-            location = (rnd.randrange(L.width),rnd.randrange(L.width))
-            x, y = location
-            avg_x += x
-            avg_y += y
-            self.hh_locations[hh] = location
-            self.houses_by_loc[location].append(hh)
-            lineage_kinship_span = min_founder_kin_span + span_interval*hh.lineage
-            founder = F.Forager(-1, kinship_span=lineage_kinship_span) # create a new forager with random adult age
-            hh.addParent(founder)
-            self.kinship_spans.append(lineage_kinship_span)
-            self.pop_expertise.append(founder.innate_foraging_expertise)
-            spouse = F.Forager(founder.age, kinship_span=lineage_kinship_span)
-            founder.marry(spouse)
-            self.kinship_spans.append(lineage_kinship_span)
-            self.pop_expertise.append(spouse.innate_foraging_expertise)
-            self.hh_food_stored.append(0)
+        span_interval = (config.max_founder_kin_span - config.min_founder_kin_span)/numagents
+        if engine == 'array':
+            self.populateArrays(numagents, span_interval)
+        else:
+            self.populate(numagents, span_interval)
+            self.updateBestLocations()
         
         # metrics initializations
-        avg_x /= numagents
-        avg_y /= numagents    
-        self.population = sum([hh.size() for hh in self.households])
+        self.population = self.populationCount()
         self.populations = [self.population]
+        self.population_total = self.population  # running sum of populations
+        self.population_window = collections.deque([self.population], maxlen=100)  # the last 100 populations
+        self.population_window_total = self.population
         self.avg_pop = [self.population]
         self.avg_pop_100 = [self.population]
         self.avg_hh_size = [2]
@@ -130,32 +183,115 @@ class World(object):
         self.com_sharing = []  #communal sharing
         self.brn_sharing = []
         self.grn_sharing = []
-        self.ages_at_death = []
+        self.ages_at_death = U.IntegerHistogram()
         self.avg_ages = []  # track average ages at death at each tick for plotting
-        self.adult_ages_at_death = []
+        self.adult_ages_at_death = U.IntegerHistogram()
         self.avg_adult_ages = [] # track average adult ages at death at each tick for plotting
         self.hh_prestige = []
         self.median_storage = [0]
         self.max_hoover = []
         self.avg_hoover = []
         self.avg_food_stored = []
+        self.agents_created = []  # foragers and households allocated each step
+        self.agents_reused = []   # foragers and households recycled from the pool each step
+        self.gc = A.GCSchedule(config.gc_interval, config.gc_freeze)
+    
+    def close(self):
+        # gives the garbage collector back as it was before the world was created
+        self.gc.release()
+    
+    def populate(self, numagents, span_interval):
+        self.engine = None
+        self.households = [self.newHousehold() for i in range(numagents)]
+        for hh in self.households:
+            location = (self.streams.movement.randrange(self.config.width),self.streams.movement.randrange(self.config.width))
+            self.spatial.insert(hh, location)
+            lineage_kinship_span = self.config.min_founder_kin_span + span_interval*hh.lineage
+            founder = self.newForager(-1, kinship_span=lineage_kinship_span) # create a new forager with random adult age
+            hh.addParent(founder)
+            self.kinship_spans.append(lineage_kinship_span)
+            self.pop_expertise.append(founder.innate_foraging_expertise)
+            spouse = self.newForager(founder.age, kinship_span=lineage_kinship_span)
+            founder.marry(spouse)
+            self.kinship_spans.append(lineage_kinship_span)
+            self.pop_expertise.append(spouse.innate_foraging_expertise)
+            self.hh_food_stored.append(0)
+    
+    def populateArrays(self, numagents, span_interval):
+        self.households = []  # the engine keeps its own households
+        spans = [self.config.min_founder_kin_span + span_interval*lineage for lineage in range(numagents)]
+        self.engine = AE.ArrayEngine(self, numagents, spans)
+        self.kinship_spans = [span for span in spans for parent in range(2)]
+        self.pop_expertise = self.engine.f_expertise[:self.engine.f_count].tolist()
+        self.hh_food_stored = [0]*numagents
+    
+    def reconfigure(self, config):
+        """ Carries on under config, which may differ from the world's configuration only in C.BRANCHABLE parameters. """
+        fixed = [name for name in config._fields
+                 if name not in C.BRANCHABLE and getattr(config, name) != getattr(self.config, name)]
+        if fixed:
+            raise ValueError("%s can't be changed once the world exists"%(", ".join(fixed),))
+        self.config = config
+        if self.engine is not None:
+            self.engine.config = config
+    
+    def save_snapshot(self, path):
+        """ Writes the whole state of the world to path, to be restored by load_snapshot (see snapshot.py). """
+        SN.save(self, path)
+    
+    @staticmethod
+    def load_snapshot(path):
+        """ The world saved at path, ready to step on exactly as it would have. """
+        return SN.load(path)
+    
+    def populationCount(self):
+        if self.engine is not None:
+            return int(self.engine.f_alive.sum())
+        return sum([hh.size() for hh in self.households])
+    
+    def householdCount(self):
+        if self.engine is not None:
+            return self.engine.householdCount()
+        return len(self.households)
+    
+    def newForager(self, age=0, parents=[], kinship_span=2):
+        return self.pool.make(F.Forager, self, age, parents, kinship_span)
+    
+    def newHousehold(self, lineage=None):
+        return self.pool.make(HH.HHAgent, self, lineage)
+    
+    def nextForagerID(self):
+        # consecutive from 0 in each world, as the pedigree requires
+        ID = self.next_forager_ID
+        self.next_forager_ID += 1
+        return ID
+    
+    def nextHouseholdID(self):
+        ID = self.next_household_ID
+        self.next_household_ID += 1
+        return ID
             
     def spawnHouseholdFrom(self, forager):
         location = self.hh_locations[forager.household]
-        new_hh = HH.HHAgent(lineage=forager.lineage)
+        new_hh = self.newHousehold(lineage=forager.lineage)
         new_hh.addParent(forager)
         self.households.append(new_hh)
-        self.hh_locations[new_hh] = location
-        self.houses_by_loc[location].append(new_hh)
+        self.spatial.insert(new_hh, location)
     
     def bestLocationAt(self, pos):
+        # O(1) when the richest cell around pos is the only one and nobody has foraged it since
+        # updateBestLocations(); a tie, an empty neighborhood or a foraged best cell is scanned anew
+        x, y = pos
+        if self.best_known[x][y]:
+            loc = self.best_cells[x][y]
+            if loc not in self.foraged:
+                return (loc, self.best_resources[x][y])
+        return self.scanLocationsAt(pos)
+    
+    def scanLocationsAt(self, pos):
         max_resources = 0
         maxloc = (0,0)
-        a_set = [i for i in range(-1,2)]
-        b_set = [i for i in range(-1,2)]
-        rnd.shuffle(a_set)
-        rnd.shuffle(b_set)
-        locs = [addlocs(pos,(a,b)) for a in a_set for b in b_set]
+        locs = [self.spatial.wrap(pos, offset) for offset in self.scanOffsets()]
         for loc in locs:
             resources = self.foraging_resources[loc]
             if max_resources < resources:
@@ -164,16 +300,102 @@ class World(object):
         
         return (maxloc, max_resources)
     
+    def scanOffsets(self):
+        # the 3x3 neighborhood in the order it is scanned, which breaks ties between the richest cells:
+        # a random order of the rows, and of the columns
+        a_set = [i for i in range(-1,2)]
+        b_set = [i for i in range(-1,2)]
+        self.streams.movement.shuffle(a_set)
+        self.streams.movement.shuffle(b_set)
+        return [(a, b) for a in a_set for b in b_set]
+    
+    def updateBestLocations(self):
+        """
+        Finds the richest cell in the 3x3 neighborhood of every cell at once.  Only cells
+        whose maximum is positive and unique are marked known: the scan in bestLocationAt
+        always returns a unique maximum, so only ties need its random order.
+        """
+        resources = self.foraging_resources
+        width = resources.shape[0]
+        # around[k][x,y] is the resources at (x,y) + NEIGHBOR_OFFSETS[k]
+        around = NP.stack([NP.roll(resources, (-a, -b), axis=(0, 1)) for a, b in NEIGHBOR_OFFSETS])
+        best = around.argmax(axis=0)
+        best_resources = NP.take_along_axis(around, best[NP.newaxis], axis=0)[0]
+        unique = (around == best_resources).sum(axis=0) == 1
+        coords = NP.arange(width)
+        best_x = (coords[:, NP.newaxis] + NEIGHBOR_DX[best]) % width
+        best_y = (coords[NP.newaxis, :] + NEIGHBOR_DY[best]) % width
+        self.best_cells = [list(zip(row_x, row_y)) for row_x, row_y in zip(best_x.tolist(), best_y.tolist())]
+        self.best_resources = best_resources.tolist()
+        self.best_known = (unique & (best_resources > 0)).tolist()
+        self.foraged = set()  # cells foraged since, whose resources no longer match the map
+    
     def step(self):
-        emptyhouses = []
+        self.spatial.clearMemo()  # neighborhoods are memoized for one step at most
+        self.pool.resetCounts()
         self.food_shared_step = 0
+        self.brn_sharing.append(0)
+        self.grn_sharing.append(0)
+        self.com_sharing.append(0)
+        self.time += 1
+        if self.recorder is None:
+            collect = M.COLLECTIONS
+        else:
+            collect = self.recorder.collectionsDue(self.time)
+        if self.engine is not None:
+            self.engine.step(collect)
+        else:
+            self.stepHouseholds(collect)
+        
+        self.regrowth()
+        if self.engine is None:
+            self.updateBestLocations()
+        
+        #metrics
+        if self.recorder is None:
+            self.computeHooverMetrics()
+        self.avg_hh_age.append(self.tot_hh_age/self.dead_houses)
+#         self.avg_hh_age.append(self.tot_hh_age/len(self.dead_houses))
+        if self.householdCount()>0:
+            self.avg_hh_size.append(self.population/self.householdCount())
+        else :
+            self.avg_hh_size.append(0)
+        self.food_shared.append(self.food_shared_step)
+        self.food_shared_total += self.food_shared_step
+        self.food_shared_totals.append(self.food_shared_total)
+        
+        self.populations.append(self.population)
+        self.population_total += self.population
+        self.avg_pop.append(self.population_total/len(self.populations))
+        if len(self.population_window) == self.population_window.maxlen:
+            self.population_window_total -= self.population_window[0]
+        self.population_window.append(self.population)
+        self.population_window_total += self.population
+        self.avg_pop_100.append(self.population_window_total/len(self.population_window))
+            
+        self.avg_ages.append(self.ages_at_death.mean())
+        self.avg_adult_ages.append(self.adult_ages_at_death.mean())
+        if self.recorder is None:
+            self.computeWealthMetrics()
+        else:
+            self.recorder.record(self, self.time)
+        
+        self.pool.recycle()
+        self.agents_created.append(self.pool.created)
+        self.agents_reused.append(self.pool.reused)
+        self.gc.step()
+    
+    def stepHouseholds(self, collect=M.COLLECTIONS):
+        emptyhouses = []
         
         #activation order
-        if F.homogeneous():  # completely random activation order if homogeneous foraging abilities
-            rnd.shuffle(self.households)
+        if self.config.homogeneous():  # completely random activation order if homogeneous foraging abilities
+            self.streams.activation.shuffle(self.households)
         else:   # activate based on foraging ability with some randomness
-            activation_order = lambda hh : hh.foragingAbility()*U.GenBoundedRandomNormal(1, 0.2, 0.5, 1.5)
-            self.households = sorted(self.households, key=lambda hh: activation_order(hh))
+            abilities = NP.array([hh.foragingAbility() for hh in self.households])
+            noise = self.streams.activation.normals.take(1, 0.2, 0.5, 1.5, len(self.households))
+            order = NP.argsort(abilities*noise, kind='stable')
+            self.households = [self.households[i] for i in order]
         avg_x=0
         avg_y=0
         self.population = 0
@@ -181,11 +403,13 @@ class World(object):
         self.hh_food_stored = []
         self.pop_expertise = []
         self.hh_prestige = []
+        collect_members = M.MEMBERS in collect
+        collect_prestige = M.PRESTIGE in collect
+        collect_storage = M.STORAGE in collect
         
-        self.brn_sharing.append(0)
-        self.grn_sharing.append(0)
-        self.com_sharing.append(0)
         for hh in self.households:
+            if hh not in self.hh_locations:  # combined into a household that stepped before it
+                continue
             hh.step()
             
             if hh.hasDied():
@@ -197,38 +421,18 @@ class World(object):
                 x, y = self.hh_locations[hh]
                 avg_x += x
                 avg_y += y
-                for member in hh.members():
-                    self.kinship_spans.append(member.kinship_span)
-                    self.pop_expertise.append(member.innate_foraging_expertise)
-                self.hh_prestige.append(hh.prestige())
-                self.hh_food_stored.append(hh.food_storage)
+                if collect_members:
+                    for member in hh.members():
+                        self.kinship_spans.append(member.kinship_span)
+                        self.pop_expertise.append(member.innate_foraging_expertise)
+                if collect_prestige:
+                    self.hh_prestige.append(hh.prestige())
+                if collect_storage:
+                    self.hh_food_stored.append(hh.food_storage)
         
         for hh in emptyhouses:
             self.removeHousehold(hh)
-        
-        self.regrowth()
-        
-        #metrics
-        self.avg_hh_age.append(self.tot_hh_age/self.dead_houses)
-#         self.avg_hh_age.append(self.tot_hh_age/len(self.dead_houses))
-        if len(self.households)>0:
-            self.avg_hh_size.append(self.population/len(self.households))
-        else :
-            self.avg_hh_size.append(0)
-        self.food_shared.append(self.food_shared_step)
-        self.food_shared_total += self.food_shared_step
-        self.food_shared_totals.append(self.food_shared_total)
-        
-        self.populations.append(self.population)
-        self.avg_pop.append(sum(self.populations)/len(self.populations))
-        if len(self.populations) < 100:
-            self.avg_pop_100.append(sum(self.populations)/len(self.populations))
-        else:
-            self.avg_pop_100.append(sum(self.populations[-100:])/100)
-            
-        self.avg_ages.append(U.mean(self.ages_at_death))
-        self.avg_adult_ages.append(U.mean(self.adult_ages_at_death))
-        self.computeWealthMetrics()
+        self.households = [hh for hh in self.households if hh in self.hh_locations]
         
     def computeWealthMetrics(self):
         self.median_storage.append(U.median(self.hh_food_stored))
@@ -247,30 +451,71 @@ class World(object):
         self.com_sharing[-1] += amount
     
     def reportADeath(self, forager):
-        self.ages_at_death.append(forager.age)
-        if forager.age >= F.AGE_OF_ADULT:
-            self.adult_ages_at_death.append(forager.age)
+        self.pedigree.forget(forager.ID)
+        self.reportADeathAt(forager.age)
+    
+    def reportADeathAt(self, age):
+        self.ages_at_death.add(age)
+        if age >= F.AGE_OF_ADULT:
+            self.adult_ages_at_death.add(age)
     
     def regrowth(self):
-        hoovers = []
-        for x in range(L.width):
-            for y in range(L.width):
-                if self.foraging_resources[(x,y)] <= 0 :
-                    # landscape resources can't actually go to zero or it won't regrow
-                    self.foraging_resources[(x,y)] = resource_zero 
-                self.foraging_resources[(x,y)] *= self.regrowth_rate[x,y]
-                if self.foraging_resources[(x,y)] > self.max_foraging_resources[(x,y)]:
-                    self.foraging_resources[(x,y)] = self.max_foraging_resources[(x,y)]
-                #compute the local hoover index
-                residents = self.getNeighborsAround2((x,y), radius=1)
-                stored_amounts = []
-                for resident in residents:
-                    stored_amounts.append(resident.food_storage)
-                local_hoover = U.HooverIndex(stored_amounts)
-                hoovers.append(local_hoover)
-        self.max_hoover.append(max(hoovers))
-        self.avg_hoover.append(U.mean(hoovers))
-                
+        resources = self.foraging_resources
+        # landscape resources can't actually go to zero or it won't regrow
+        resources[resources <= 0] = resource_zero
+        resources *= self.regrowth_rate
+        NP.minimum(resources, self.max_foraging_resources, out=resources)
+    
+    def computeHooverMetrics(self):
+        max_hoover, avg_hoover = self.hooverMetrics()
+        self.max_hoover.append(max_hoover)
+        self.avg_hoover.append(avg_hoover)
+    
+    def hooverMetrics(self):
+        hoovers = self.localHooverIndices(radius=1)
+        # every cell without a local index has an index of 0
+        values = [hoovers[cell] for cell in sorted(hoovers)]
+        if len(values) < self.config.width**2:
+            values.append(0)
+        return max(values), sum(values)/self.config.width**2
+    
+    def localHooverIndices(self, radius=1):
+        """
+        The Hoover index of household food storage around every cell, as a dictionary by cell.
+        Only cells with two or more households within the radius are included, since the index
+        is 0 everywhere else.  Storage amounts are visited in the same order as
+        getNeighborsAround2, so the indices are identical to U.HooverIndex of that list.
+        """
+        if self.engine is not None:
+            return self.engine.localHooverIndices(radius)
+        stored_at = {}
+        for loc, residents in self.houses_by_loc.items():
+            if residents:
+                stored_at[loc] = [hh.food_storage for hh in residents]
+        offsets = self.spatial.discOffsets(radius)
+        candidates = set()
+        for loc in stored_at:
+            for offset in offsets:
+                # the disc is symmetric, so this is every cell that has loc within its radius
+                candidates.add(self.spatial.wrap(loc, offset))
+        hoovers = {}
+        for cell in candidates:
+            stored_amounts = []
+            for offset in offsets:
+                loc = self.spatial.wrap(cell, offset)
+                if loc in stored_at:
+                    stored_amounts.extend(stored_at[loc])
+            if len(stored_amounts) < 2:
+                continue
+            # U.HooverIndex, with the sum taken once
+            sum_values = sum(stored_amounts)
+            if sum_values==0:
+                hoovers[cell] = 0
+                continue
+            avg = sum_values/len(stored_amounts)
+            above_avg = [value for value in stored_amounts if value > avg]
+            hoovers[cell] = (sum(above_avg) - avg*len(above_avg))/sum_values
+        return hoovers
             
     def forageResources(self, hh, amount_to_gather):
         location = self.hh_locations[hh]
@@ -281,62 +526,93 @@ class World(object):
         else:
             gathered = amount_to_gather
         self.foraging_resources[location] -= gathered
+        self.foraged.add(location)
         
         return gathered
     
     def getNeighborhoodOf(self, hh, radius=1):
         p0 = self.locationOf(hh)
-        neighborhood = []
-        r_squared = radius*radius
-        for dx in range(-radius, radius+1):
-            for dy in range(-radius, radius+1):
-                if (dx**2 + dy**2) <= r_squared:
-                    neighborhood.extend(self.houses_by_loc[addlocs(p0, (dx,dy))])
+        neighborhood = list(self.spatial.neighbors(p0, radius))
         neighborhood.remove(hh)
-        rnd.shuffle(neighborhood)
+        self.streams.movement.shuffle(neighborhood)
         
         return neighborhood
     
     def getNeighborsAround(self, p0, radius=1):
         neighborhood = self.getNeighborsAround2(p0, radius)
-        rnd.shuffle(neighborhood)
+        self.streams.movement.shuffle(neighborhood)
         
         return neighborhood
     
     def getNeighborsAround2(self, p0, radius=1):
-        neighborhood = []
-        r_squared = radius*radius
-        for dx in range(-radius, radius+1):
-            for dy in range(-radius, radius+1):
-                if (dx**2 + dy**2) <= r_squared:
-                    neighborhood.extend(self.houses_by_loc[addlocs(p0, (dx,dy))])
-        
-        return neighborhood
+        return list(self.spatial.neighbors(p0, radius))
+    
+    @property
+    def neighborhood_hits(self):
+        return self.spatial.hits
+    
+    @property
+    def neighborhood_misses(self):
+        return self.spatial.misses
     
     def moveHousehold(self, hh, p):
-        location = addlocs(self.hh_locations[hh], p)
-        old = self.hh_locations[hh]
-        self.hh_locations[hh] = location
-        self.houses_by_loc[old].remove(hh)
-        self.houses_by_loc[location].append(hh)
+        location = self.spatial.wrap(self.hh_locations[hh], p)
+        self.spatial.move(hh, location)
     
     def moveHouseholdTo(self, hh, p):
-        old = self.hh_locations[hh]
-        self.houses_by_loc[old].remove(hh)
-        self.hh_locations[hh] = p
-        try:
-            self.houses_by_loc[p].append(hh)
-        except:
-            pass
+        self.spatial.move(hh, p)
         
     def removeHousehold(self, hh):
+        # hh stays in self.households until the end of the step, so that removing it doesn't
+        # make the loop in stepHouseholds skip the household after it
         try :
-            self.households.remove(hh)
-            loc = self.hh_locations[hh]
-            del self.hh_locations[hh]
-            self.houses_by_loc[loc].remove(hh)
-        except:
-            pass
+            self.spatial.remove(hh)
+        except KeyError:  # removed already
+            return
+        self.ledger.remove(hh.ID)
+        hh.invalidateKinSet()
+        if hh.nextBaby != None:
+            self.pool.release(hh.nextBaby)
+        self.pool.release(hh)
+    
+    def indexKin(self, hh, kin_set):
+        if hh in self.hh_locations:  # households already removed are not indexed again
+            for ancestor in kin_set:
+                related = self.kin_index.get(ancestor)
+                if related is None:
+                    self.kin_index[ancestor] = {hh}
+                else:
+                    related.add(hh)
+    
+    def unindexKin(self, hh, kin_set):
+        for ancestor in kin_set:
+            related = self.kin_index.get(ancestor)
+            if related is not None:
+                related.discard(hh)
+                if not related:
+                    del self.kin_index[ancestor]
+    
+    def partitionKin(self, hh, candidates):
+        """
+        Splits candidates into those that are kin of hh (see HHAgent.kinshipWith) and those that
+        are not, keeping their order, in one pass.  Returns (kin, nonkin, total kin food storage).
+        """
+        for candidate in candidates:
+            candidate.kinSet()  # makes sure every candidate is in the index
+        kin_set = hh.kinSet()
+        related = set()
+        for ancestor in kin_set:
+            related.update(self.kin_index.get(ancestor, ()))
+        kin = []
+        nonkin = []
+        for candidate in candidates:
+            if candidate in related:
+                kin.append(candidate)
+            elif candidate not in self.hh_locations and not kin_set.isdisjoint(candidate.kinSet()):
+                kin.append(candidate)  # removed from the world mid-step, so not indexed
+            else:
+                nonkin.append(candidate)
+        return kin, nonkin, sum([candidate.food_storage for candidate in kin])
         
     def locationOf(self, hh):
         try: